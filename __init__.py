@@ -1,2 +1,7 @@
-from .tetris.gui import GameGUI
-from .tetris.game import Tetris
+from . import tetris
+from .tetris import Tetris, VecTetris
+
+
+def __getattr__(name):
+    # lazy members of the tetris package, like GameGUI
+    return getattr(tetris, name)
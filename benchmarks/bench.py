@@ -0,0 +1,341 @@
+#!/usr/local/bin/python3
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+from tetris import Tetris
+from tetris.tetromino import Piece
+
+ACTIONS = {
+    0: 'noop',
+    1: 'left',
+    2: 'right',
+    3: 'down',
+    4: 'hard_drop',
+    5: 'rotate_ccw',
+    6: 'rotate_cw',
+    7: 'hold',
+}
+# moves of one decision of a policy, run by step_many
+MACRO = (1, 1, 5, 3, 3, 4)
+# ratio of visible rows that are filled with blocks
+FILLS = (0.0, 0.25, 0.5)
+BACKENDS = ('numpy', 'bitboard')
+# (width, height) of boards of board size benchmarks, the default one, a
+# tall one and a wide one
+SIZES = ((10, 22), (10, 202), (40, 42))
+SEED = 0
+
+cmd_parser = argparse.ArgumentParser(description='Benchmarks of tetris engine and GUI.')
+cmd_parser.add_argument('-o', '--output', default=None,
+                        help='Write results to this JSON file.')
+cmd_parser.add_argument('-b', '--baseline', default=None,
+                        help='Compare results with this JSON file of a previous run.')
+cmd_parser.add_argument('-t', '--threshold', default=0.25, type=float,
+                        help='Slow down ratio over baseline that is reported as regression, '
+                             'runs of the same tree differ by up to about 15%%.')
+cmd_parser.add_argument('-n', '--number', default=1000, type=int,
+                        help='Number of calls of every measurement.')
+cmd_parser.add_argument('-r', '--repeat', default=3, type=int,
+                        help='Number of measurements, the fastest one is kept, benchmarks '
+                             'subtracting a setup keep the median of number*repeat calls.')
+cmd_parser.add_argument('-k', '--filter', default='',
+                        help='Only run benchmarks whose name contains this string.')
+cmd_parser.add_argument('--no-gui', default=False, action='store_true',
+                        help='Skip GUI benchmarks.')
+
+
+def make_board(fill, clear, seed=SEED, width=10, height=22):
+    """
+    Board with the bottom fill ratio of visible rows filled with blocks, no
+    row is full. If clear, the bottom 4 rows are full except the last column
+    and it is empty, so a vertical line of four dropped there clears them.
+    """
+    rng = np.random.RandomState(seed)
+    board = np.zeros((width, height), dtype=np.int8)
+    for y in range(height-int(fill*(height-2)), height):
+        board[:, y] = rng.randint(1, 8, size=width) * (rng.rand(width) < 0.7)
+        board[rng.randint(width), y] = 0
+    if clear:
+        board[:, height-4:] = rng.randint(1, 8, size=(width, 4))
+        board[width-1, :] = 0
+    return board
+
+
+def make_env(backend, fill, clear, action, **kwargs):
+    """
+    Env ready to run action, returns it with a snapshot of its state.
+    """
+    env = Tetris(horizon=-1, backend=backend, seed=SEED, **kwargs)
+    env.reset()
+    env.main_board[:] = make_board(fill, clear, width=env.width, height=env.height)
+    env.sync_board()
+    if clear:
+        # vertical line of four above the last column, landing with move down
+        env.piece = Piece(0, env.spawn)
+        env.piece.commit([env.width-2, env.height-4 if action == 3 else 0], 0)
+    else:
+        env.piece = Piece(3, env.spawn)
+    return env, env.clone_state()
+
+
+def measure(fn, number, repeat):
+    """
+    Returns the fastest mean time of fn in microseconds over repeat runs.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        t = (time.perf_counter() - start) / number * 1e6
+        if best is None or t < best:
+            best = t
+    return best
+
+
+def measure_delta(fn, base, number, repeat):
+    """
+    Returns the median difference in microseconds between the times of fn
+    and base. They are timed back to back in the same loop so that the
+    state of the machine changes both alike, number*repeat pairs are timed.
+    """
+    timer = time.perf_counter
+    deltas = np.empty(number * repeat)
+    for k in range(len(deltas)):
+        start = timer()
+        base()
+        middle = timer()
+        fn()
+        deltas[k] = (timer() - middle) - (middle - start)
+    return max(float(np.median(deltas)) * 1e6, 0.0)
+
+
+def bench_step(backend, action, fill, clear, number, repeat, size=(10, 22)):
+    env, state = make_env(backend, fill, clear, action, width=size[0], height=size[1])
+    def restore():
+        env.restore_state(state)
+    def step():
+        env.restore_state(state)
+        env.step(action)
+    # every step starts from the same state, restore time is subtracted
+    return measure_delta(step, restore, number, repeat)
+
+
+def bench_step_many(backend, actions, fill, number, repeat):
+    env, state = make_env(backend, fill, False, 0)
+    def restore():
+        env.restore_state(state)
+    def step_many():
+        env.restore_state(state)
+        env.step_many(actions)
+    return measure_delta(step_many, restore, number, repeat)
+
+
+def bench_placements(backend, fill, number, repeat):
+    """
+    Search of all placements of the current piece, as heuristic policies do.
+    """
+    env, _ = make_env(backend, fill, False, 0)
+    def placements():
+        # placements are cached until the board changes
+        env.board_version += 1
+        env.get_placements()
+    return measure(placements, number, repeat)
+
+
+def bench_reset(backend, number, repeat):
+    env = Tetris(horizon=-1, backend=backend, seed=SEED)
+    return measure(env.reset, number, repeat)
+
+
+def bench_observation(flattened, inplace, fill, number, repeat):
+    env, _ = make_env('numpy', fill, False, 0, flattened_observation=flattened,
+                      inplace_observation=inplace)
+    return measure(env.get_observation, number, repeat)
+
+
+def bench_board(backend, action, size, number, repeat):
+    """
+    Step that lands a piece and clears 4 lines on a (width, height) board.
+    """
+    return bench_step(backend, action, 0.1, True, number, repeat, size)
+
+
+def bench_board_observation(size, number, repeat):
+    """
+    Inplace observation after main board of a (width, height) board changed.
+    """
+    env, state = make_env('numpy', 0.1, False, 0, inplace_observation=True,
+                          width=size[0], height=size[1])
+    def restore():
+        env.restore_state(state)
+    def observe():
+        env.restore_state(state)
+        env.get_observation()
+    return measure_delta(observe, restore, number, repeat)
+
+
+def bench_rgb(fill, number, repeat):
+    env, _ = make_env('numpy', fill, False, 0)
+    return measure(lambda: env.render(mode='rgb_array'), number, repeat)
+
+
+def bench_server_tick(sessions, number, repeat):
+    """
+    Tick of a GameServer without clients where every game has a move and
+    a rotation queued.
+    """
+    from tetris import GameServer
+    server = GameServer(max_pending=2**30)
+    games = [server.open_session(None, seed=SEED+k, gravity=1000) for k in range(sessions)]
+    def tick():
+        for game in games:
+            server.queue(game, [1, 6])
+        server.tick()
+        # keep games going
+        for game in games:
+            if game.env.game_over:
+                game.env.reset()
+    return measure(tick, number, repeat)
+
+
+def bench_import(module, number, repeat):
+    """
+    Time of importing module in a fresh interpreter, startup time of the
+    interpreter is subtracted.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    def run(code):
+        subprocess.check_call([sys.executable, '-W', 'ignore', '-c', code], cwd=root)
+    # warm up file system caches
+    run('import %s' % module)
+    return max(measure(lambda: run('import %s' % module), number, repeat) -
+               measure(lambda: run('pass'), number, repeat), 0.0)
+
+
+def bench_gui(number, repeat):
+    """
+    Frame time of GameGUI.draw(), None if there is no display.
+    """
+    try:
+        import tkinter as tk
+    except ImportError:
+        return None
+    from tetris import GameGUI
+    gui = GameGUI(mode='agent')
+    try:
+        gui.init_gui()
+    except tk.TclError:
+        return None
+    gui.game_started = True
+    env = gui.get_env()
+    env.seed(SEED)
+    env.reset()
+    env.main_board[:] = make_board(0.5, False)
+    env.sync_board()
+    try:
+        return measure(gui.draw, number, repeat)
+    finally:
+        gui.close()
+
+
+def run(args):
+    benchmarks = []
+    for backend in BACKENDS:
+        for fill in FILLS:
+            for action, name in ACTIONS.items():
+                benchmarks.append(('step/%s/%s/fill%.2f' % (backend, name, fill),
+                                   bench_step, (backend, action, fill, False)))
+            for action in (3, 4):
+                benchmarks.append(('step/%s/%s_clear/fill%.2f' % (backend, ACTIONS[action], fill),
+                                   bench_step, (backend, action, fill, True)))
+        benchmarks.append(('step_many/%s/%d' % (backend, len(MACRO)), bench_step_many,
+                           (backend, MACRO, 0.25)))
+        benchmarks.append(('placements/%s/fill%.2f' % (backend, 0.25), bench_placements,
+                           (backend, 0.25)))
+        benchmarks.append(('reset/%s' % backend, bench_reset, (backend,)))
+    for flattened in (False, True):
+        for inplace in (False, True):
+            benchmarks.append(('observation/%s%s' % ('flattened' if flattened else '2d',
+                                                     '/inplace' if inplace else ''),
+                               bench_observation, (flattened, inplace, 0.5)))
+    # per step cost should not grow with the height of boards
+    for width, height in SIZES:
+        size = '%dx%d' % (width, height)
+        for backend in BACKENDS:
+            for action in (3, 4):
+                benchmarks.append(('size/%s/%s_clear/%s' % (backend, ACTIONS[action], size),
+                                   bench_board, (backend, action, (width, height))))
+        benchmarks.append(('size/observation/inplace/%s' % size, bench_board_observation,
+                           ((width, height),)))
+    benchmarks.append(('render/rgb_array', bench_rgb, (0.5,)))
+    benchmarks.append(('server/tick/1000', bench_server_tick, (1000,)))
+    benchmarks.append(('import/tetris', bench_import, ('tetris',)))
+    if not args.no_gui:
+        benchmarks.append(('gui/draw', bench_gui, ()))
+    results = {}
+    for name, fn, fn_args in benchmarks:
+        if args.filter not in name:
+            continue
+        number = args.number
+        if name.startswith('gui'):
+            number = max(args.number // 20, 1)
+        elif name.startswith('import'):
+            number = max(args.number // 100, 1)
+        elif name.startswith('server') or name.startswith('placements'):
+            number = max(args.number // 50, 1)
+        us = fn(*(fn_args + (number, args.repeat)))
+        if us is None:
+            print('%-48s skipped' % name)
+            continue
+        results[name] = {'us': us, 'per_sec': 1e6 / us if us > 0 else None}
+        print('%-48s %10.2f us' % (name, us))
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'number': args.number,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Print time ratio of every benchmark over baseline and return the names
+    of the ones that are slower by more than threshold.
+    """
+    regressions = []
+    print('%-48s %10s %10s %8s' % ('benchmark', 'base us', 'us', 'ratio'))
+    for name, result in sorted(results['results'].items()):
+        base = baseline['results'].get(name)
+        if base is None or base['us'] <= 0:
+            continue
+        ratio = result['us'] / base['us']
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = ' REGRESSION'
+        print('%-48s %10.2f %10.2f %8.2f%s' % (name, base['us'], result['us'], ratio, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+    args = cmd_parser.parse_args()
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
@@ -0,0 +1,235 @@
+#!/usr/local/bin/python3
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+import traceback
+import numpy as np
+from tetris import Tetris
+from tetris.policies import load_policy
+
+cmd_parser = argparse.ArgumentParser(description='Generate a dataset of transitions played by a policy.')
+cmd_parser.add_argument('output',
+                        help='Directory of shards and progress, a run is resumed if it exists.')
+cmd_parser.add_argument('-e', '--episodes', default=1000, type=int,
+                        help='Number of episodes.')
+cmd_parser.add_argument('-p', '--policy', default='random',
+                        help="'random', 'heuristic' or module:function called as function(seed), which "
+                             "returns the policy of an episode called as policy(env, state).")
+cmd_parser.add_argument('-w', '--workers', default=None, type=int,
+                        help='Number of worker processes, default is the number of cpus.')
+cmd_parser.add_argument('-t', '--horizon', default=5000, type=int,
+                        help='Max number of steps for an episode, -1 means infinity.')
+cmd_parser.add_argument('-s', '--seed', default=0, type=int,
+                        help='Episode k is played with seed+k.')
+cmd_parser.add_argument('-f', '--format', default='int8',
+                        help='Observation format: int8, packed or onehot.')
+cmd_parser.add_argument('--flattened', default=False, action='store_true',
+                        help='Use flattened observations.')
+cmd_parser.add_argument('--shard-size', default=64, type=float,
+                        help='Max size of a shard in MB, unless one episode is larger.')
+cmd_parser.add_argument('--chunk-size', default=256, type=int,
+                        help='Number of transitions a worker sends at once.')
+cmd_parser.add_argument('--queue-size', default=64, type=int,
+                        help='Max number of chunks waiting to be written, workers block when it is full.')
+cmd_parser.add_argument('--compress', default=False, action='store_true',
+                        help='Write compressed npz shards.')
+cmd_parser.add_argument('--report', default=5, type=float,
+                        help='Seconds between progress reports.')
+
+# settings that must match when a run is resumed
+CONFIG = ('policy', 'horizon', 'seed', 'format', 'flattened')
+FIELDS = ('obs', 'action', 'reward', 'done', 'episode')
+PROGRESS = 'progress.json'
+
+
+def worker(tasks, results, args):
+    """
+    Play episodes taken from tasks and send their transitions to results
+    in chunks, it blocks while results is full. An error is sent as its
+    traceback string, and None is always sent when the worker stops.
+    """
+    env = Tetris(horizon=args['horizon'], flattened_observation=args['flattened'],
+                 observation_format=args['format'], backend='bitboard')
+    chunk_size = args['chunk_size']
+    try:
+        make_policy = load_policy(args['policy'])
+        while True:
+            episode = tasks.get()
+            if episode is None:
+                break
+            env.seed(args['seed'] + episode)
+            policy = make_policy(args['seed'] + episode)
+            state = env.reset()
+            obs = np.zeros((chunk_size,)+state.shape, dtype=state.dtype)
+            actions = np.zeros(chunk_size, dtype=np.uint8)
+            rewards = np.zeros(chunk_size, dtype=np.int32)
+            done = False
+            n = 0
+            while not done:
+                action = policy(env, state)
+                obs[n] = state
+                actions[n] = action
+                state, rewards[n], done = env.step(action)
+                n += 1
+                if n == chunk_size or done:
+                    results.put((episode, obs[:n].copy(), actions[:n].copy(), rewards[:n].copy(), done))
+                    n = 0
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        results.put(traceback.format_exc())
+    finally:
+        results.put(None)
+
+
+class ShardWriter(object):
+    """
+    Write chunks of episodes to npz shards of at most shard_size bytes as
+    they arrive, so an episode can span shards. Progress is saved with
+    every shard, it lists the episodes whose chunks are all written so that
+    a run can be resumed from its last shard.
+    """
+    def __init__(self, output, config, shard_size, compress):
+        self.output = output
+        self.shard_size = shard_size
+        self.compress = compress
+        self.progress = {'config': config, 'episodes': [], 'shards': []}
+        path = os.path.join(output, PROGRESS)
+        if os.path.exists(path):
+            with open(path) as f:
+                self.progress = json.load(f)
+            assert self.progress['config'] == config, \
+                'settings differ from the run in %s: %s' % (output, self.progress['config'])
+        self.done_episodes = set(self.progress['episodes'])
+        self.drop_unfinished()
+        # chunks not written yet, and episodes whose last chunk is one of them
+        self.chunks = []
+        self.chunk_bytes = 0
+        self.ending = []
+        self.written_bytes = 0
+
+    def drop_unfinished(self):
+        """
+        Remove the transitions of episodes that an interrupted run didn't
+        finish from its shards, these episodes are played again.
+        """
+        for shard in self.progress['shards']:
+            unfinished = set(shard['episodes']) - self.done_episodes
+            if not unfinished:
+                continue
+            path = os.path.join(self.output, shard['file'])
+            with np.load(path) as f:
+                data = {field: f[field] for field in FIELDS}
+            keep = ~np.isin(data['episode'], sorted(unfinished))
+            self.save({field: array[keep] for field, array in data.items()}, path)
+            shard['episodes'] = sorted(set(shard['episodes']) - unfinished)
+            shard['transitions'] = int(keep.sum())
+        self.save_progress()
+
+    def add(self, episode, obs, actions, rewards, done):
+        dones = np.zeros(len(actions), dtype=bool)
+        dones[-1] = done
+        size = obs.nbytes + actions.nbytes + rewards.nbytes + dones.nbytes
+        if self.chunks and self.chunk_bytes + size > self.shard_size:
+            self.flush()
+        self.chunks.append((episode, obs, actions, rewards, dones))
+        self.chunk_bytes += size
+        if done:
+            self.ending.append(episode)
+
+    def flush(self):
+        if not self.chunks:
+            return
+        data = {field: [] for field in FIELDS}
+        for episode, obs, actions, rewards, dones in self.chunks:
+            data['obs'].append(obs)
+            data['action'].append(actions)
+            data['reward'].append(rewards)
+            data['done'].append(dones)
+            data['episode'].append(np.full(len(actions), episode, dtype=np.int32))
+        data = {field: np.concatenate(arrays) for field, arrays in data.items()}
+        name = 'shard-%05d.npz' % len(self.progress['shards'])
+        path = os.path.join(self.output, name)
+        self.save(data, path)
+        self.done_episodes.update(self.ending)
+        self.progress['episodes'] = sorted(self.done_episodes)
+        self.progress['shards'].append({'file': name,
+                                        'episodes': sorted(set(chunk[0] for chunk in self.chunks)),
+                                        'transitions': len(data['action'])})
+        self.save_progress()
+        self.written_bytes += os.path.getsize(path)
+        self.chunks = []
+        self.chunk_bytes = 0
+        self.ending = []
+
+    def save(self, data, path):
+        # files are renamed when complete, a crash never leaves partial ones
+        with open(path + '.tmp', 'wb') as f:
+            (np.savez_compressed if self.compress else np.savez)(f, **data)
+        os.rename(path + '.tmp', path)
+
+    def save_progress(self):
+        path = os.path.join(self.output, PROGRESS)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.progress, f)
+        os.rename(path + '.tmp', path)
+
+
+def generate(args):
+    os.makedirs(args.output, exist_ok=True)
+    config = {key: getattr(args, key) for key in CONFIG}
+    writer = ShardWriter(args.output, config, int(args.shard_size*2**20), args.compress)
+    pending = [k for k in range(args.episodes) if k not in writer.done_episodes]
+    print('%d of %d episodes to play' % (len(pending), args.episodes))
+    if not pending:
+        return
+    num_workers = min(args.workers or mp.cpu_count(), len(pending))
+    tasks = mp.Queue()
+    for k in pending:
+        tasks.put(k)
+    for _ in range(num_workers):
+        tasks.put(None)
+    results = mp.Queue(maxsize=args.queue_size)
+    worker_args = dict(config, chunk_size=args.chunk_size)
+    processes = [mp.Process(target=worker, args=(tasks, results, worker_args)) for _ in range(num_workers)]
+    for p in processes:
+        p.daemon = True
+        p.start()
+    start = last_report = time.time()
+    episodes = transitions = 0
+    running = num_workers
+    try:
+        while running:
+            result = results.get()
+            if result is None:
+                running -= 1
+                continue
+            if isinstance(result, str):
+                raise RuntimeError('a worker failed:\n%s' % result)
+            writer.add(*result)
+            transitions += len(result[2])
+            episodes += result[4]
+            now = time.time()
+            if now - last_report >= args.report:
+                report(episodes, transitions, writer.written_bytes, now - start)
+                last_report = now
+        writer.flush()
+    finally:
+        for p in processes:
+            p.join(timeout=1)
+    report(episodes, transitions, writer.written_bytes, time.time() - start)
+
+
+def report(episodes, transitions, written_bytes, elapsed):
+    elapsed = max(elapsed, 1e-9)
+    print('%d episodes %.1f episodes/s, %d transitions %.0f transitions/s, %.1f MB %.2f MB/s' %
+          (episodes, episodes/elapsed, transitions, transitions/elapsed,
+           written_bytes/2**20, written_bytes/2**20/elapsed))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    generate(cmd_parser.parse_args())
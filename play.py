@@ -9,11 +9,45 @@ cmd_parser.add_argument('-t', '--horizon', default=-1, type=int,
                         help='Max number of steps for an episode, -1 means infinity')
 cmd_parser.add_argument('-a', '--agent', default=False, action='store_true',
                         help='Enable agent mode for GUI.')
+cmd_parser.add_argument('-s', '--spectate', default=False, action='store_true',
+                        help='Watch a random agent playing at full speed.')
+cmd_parser.add_argument('-k', '--render-every', default=1, type=int,
+                        help='Only draw every k-th step in spectator mode.')
+cmd_parser.add_argument('-c', '--connect', default=None,
+                        help='Play on a game server at host:port or a Unix socket path.')
+cmd_parser.add_argument('--width', default=10, type=int,
+                        help='Number of columns of main board.')
+cmd_parser.add_argument('--height', default=22, type=int,
+                        help='Number of rows of main board, including hidden ones.')
+cmd_parser.add_argument('--hidden-rows', default=2, type=int,
+                        help='Number of hidden rows at the top of main board.')
+
+
+def parse_address(address):
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return (host or '127.0.0.1', int(port))
+    return address
+
+
+def random_agent(env):
+    env.reset()
+    while True:
+        _, _, done = env.step(env.action_space.sample())
+        if done:
+            env.reset()
+
 
 if __name__ == '__main__':
     args = cmd_parser.parse_args()
-    if args.agent:
-        g = GameGUI(mode='agent', horizon=args.horizon)
+    board = {'width': args.width, 'height': args.height, 'hidden_rows': args.hidden_rows}
+    if args.connect:
+        GameGUI(mode='remote', horizon=args.horizon, address=parse_address(args.connect), **board).play()
+    elif args.spectate:
+        g = GameGUI(mode='spectator', horizon=args.horizon, render_every=args.render_every, **board)
+        g.play(random_agent)
+    elif args.agent:
+        g = GameGUI(mode='agent', horizon=args.horizon, **board)
         g.play()
         print("Input action (0-7) (q) to quit:")
         while True:
@@ -25,4 +59,4 @@ if __name__ == '__main__':
                 g.update_window()
         g.close()
     else:
-        GameGUI(mode='human', horizon=args.horizon).play()
+        GameGUI(mode='human', horizon=args.horizon, **board).play()
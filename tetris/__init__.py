@@ -1,2 +1,29 @@
-from .gui import GameGUI
 from .game import Tetris
+from .vec import VecTetris
+from .recording import Recorder, EpisodeReader
+from .features import board_features
+from .zobrist import TranspositionTable
+from .profiling import Profiler
+
+# modules loaded on first access, GameGUI needs tkinter, SubprocTetris and
+# evaluate need multiprocessing and the server asyncio, which a bare engine
+# doesn't
+LAZY = {
+    'GameGUI': 'gui',
+    'SubprocTetris': 'subproc',
+    'evaluate': 'evaluation',
+    'GameServer': 'server',
+    'Client': 'server',
+}
+
+
+def __getattr__(name):
+    if name in LAZY:
+        import importlib
+        module = importlib.import_module('.' + LAZY[name], __name__)
+        return getattr(module, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(LAZY))
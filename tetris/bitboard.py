@@ -0,0 +1,107 @@
+from .tetromino import Shapes
+
+
+def build_masks(shapes):
+    """
+    Precompute row masks for every orientation of every shape.
+    return:
+        dict of id -> list of (xmin, xmax, ymin, ymax, rows) per orientation,
+        where rows is a tuple of (y offset, mask) for every occupied line of
+        the shape and mask is shifted so that bit 0 is the column xmin.
+    """
+    masks = {}
+    for id, orientations in shapes.items():
+        masks[id] = []
+        for shape in orientations:
+            cells = [(i, j) for i, line in enumerate(shape)
+                            for j, v in enumerate(line) if v > 0]
+            xmin = min(i for i, _ in cells)
+            xmax = max(i for i, _ in cells)
+            ymin = min(j for _, j in cells)
+            ymax = max(j for _, j in cells)
+            rows = []
+            for j in range(ymin, ymax+1):
+                m = 0
+                for i, jj in cells:
+                    if jj == j:
+                        m |= 1 << (i-xmin)
+                rows.append((j, m))
+            masks[id].append((xmin, xmax, ymin, ymax, tuple(rows)))
+    return masks
+
+
+PieceMasks = build_masks(Shapes)
+
+
+class BitBoard(object):
+    """
+    Occupancy of the main board stored as one integer bitmask per row,
+    bit x of rows[y] is set if cell (x, y) is occupied.
+    width:  number of columns of the board
+    height: number of rows of the board, including hidden ones
+    """
+    def __init__(self, width=10, height=22):
+        self.width = width
+        self.height = height
+        self.full = (1 << width) - 1
+        self.rows = [0] * height
+
+    def reset(self):
+        self.rows = [0] * self.height
+
+    def load(self, board):
+        """
+        Rebuild row masks from a (width, height) board array.
+        """
+        self.rows = [0] * self.height
+        for x, y in zip(*board.nonzero()):
+            self.rows[y] |= 1 << int(x)
+
+    def fits(self, id, index, pos):
+        """
+        Check if a piece is inside the board and does not overlap blocks.
+        input:
+            id:     shape id of the piece
+            index:  orientation index of the piece
+            pos:    [x, y] of the top-left block location
+        return:
+            True if valid False otherwise
+        """
+        xmin, xmax, ymin, ymax, masks = PieceMasks[id][index]
+        x = pos[0] + xmin
+        y = pos[1]
+        if x < 0 or pos[0] + xmax >= self.width or y + ymin < 0 or y + ymax >= self.height:
+            return False
+        rows = self.rows
+        for j, m in masks:
+            if rows[y+j] & (m << x):
+                return False
+        return True
+
+    def place(self, id, index, pos):
+        """
+        Set the cells of a piece, it must have been checked by fits().
+        """
+        xmin, _, _, _, masks = PieceMasks[id][index]
+        x = pos[0] + xmin
+        y = pos[1]
+        rows = self.rows
+        for j, m in masks:
+            rows[y+j] |= m << x
+
+    def full_lines(self, top, bottom):
+        """
+        Returns indexes of full rows in range [top, bottom).
+        """
+        rows = self.rows
+        full = self.full
+        return [j for j in range(max(top, 0), min(bottom, self.height)) if rows[j] == full]
+
+    def clear_lines(self, lines):
+        """
+        Remove rows in lines (ascending order) and shift rows above down.
+        """
+        rows = self.rows
+        for j in lines:
+            del rows[j]
+            rows.insert(0, 0)
@@ -0,0 +1,12 @@
+RED         = "#eb3323"
+GREEN       = "#7ea956"
+BLUE        = "#4d73bc"
+LIGHTBLUE   = "#73fbfd"
+YELLOW      = "#f5c142"
+ORANGE      = "#e08244"
+PURPLE      = "#693799"
+BLACK       = "#000000"
+GRAY        = "#808080"
+WHITE       = "#ffffff"
+# colors indexed by block values on board
+COLORS = [BLACK, BLUE, RED, LIGHTBLUE, ORANGE, GREEN, PURPLE, YELLOW]
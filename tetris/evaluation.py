@@ -0,0 +1,232 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+import numpy as np
+from .game import Tetris
+from .policies import load_policy
+
+
+# per episode results written by evaluate, one JSON object per line, steps
+# counts every action played, including the ones that change nothing
+FIELDS = ('episode', 'seed', 'score', 'lines', 'steps', 'seconds')
+# metrics summarized over episodes
+METRICS = ('score', 'lines', 'steps', 'actions_per_second')
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+# two-sided normal quantile of 95% confidence intervals
+Z95 = 1.959964
+
+# policy and env of a worker process, set by init_worker
+worker_state = {}
+
+
+def init_worker(make_policy, horizon, env_kwargs):
+    worker_state['make_policy'] = make_policy
+    worker_state['env'] = Tetris(horizon=horizon, **env_kwargs)
+
+
+def play_episode(task):
+    """
+    Play one episode with the policy of its seed.
+    return:
+        dict of FIELDS
+    """
+    episode, seed = task
+    env = worker_state['env']
+    env.seed(seed)
+    policy = worker_state['make_policy'](seed)
+    start = time.perf_counter()
+    state = env.reset()
+    done = False
+    steps = 0
+    while not done:
+        state, _, done = env.step(policy(env, state))
+        steps += 1
+    seconds = time.perf_counter() - start
+    return {'episode': episode, 'seed': seed, 'score': env.score, 'lines': env.lines,
+            'steps': steps, 'seconds': seconds}
+
+
+def describe(values):
+    """
+    Mean, standard deviation, 95% confidence interval of the mean (normal
+    approximation), PERCENTILES, min and max of values.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n == 0:
+        return {'n': 0}
+    mean = float(values.mean())
+    std = float(values.std(ddof=1)) if n > 1 else 0.0
+    half = Z95 * std / float(np.sqrt(n))
+    out = {'n': n, 'mean': mean, 'std': std, 'ci95': [mean - half, mean + half],
+           'min': float(values.min()), 'max': float(values.max())}
+    for q, v in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        out['p%d' % q] = float(v)
+    return out
+
+
+def summarize(results):
+    """
+    Summary of episode results, see describe for the statistics of every
+    metric of METRICS.
+    return:
+        dict of metric -> statistics, and episodes and actions_per_second
+        over all episodes
+    """
+    results = sorted(results, key=lambda r: r['episode'])
+    seconds = np.array([r['seconds'] for r in results], dtype=np.float64)
+    steps = np.array([r['steps'] for r in results], dtype=np.float64)
+    summary = {'episodes': len(results),
+               'total_actions_per_second': float(steps.sum() / max(seconds.sum(), 1e-9))}
+    for metric in METRICS:
+        if metric == 'actions_per_second':
+            values = steps / np.maximum(seconds, 1e-9)
+        else:
+            values = [r[metric] for r in results]
+        summary[metric] = describe(values)
+    return summary
+
+
+def policy_name(make_policy):
+    return '%s:%s' % (getattr(make_policy, '__module__', '?'),
+                      getattr(make_policy, '__qualname__', type(make_policy).__name__))
+
+
+def load_results(path, config):
+    """
+    Results of episodes already written to path, the file is created with
+    config if it doesn't exist. A line cut by a crash is dropped.
+    """
+    results = []
+    if not os.path.exists(path):
+        with open(path, 'w') as f:
+            f.write(json.dumps({'config': config}) + '\n')
+        return results
+    with open(path, 'rb') as f:
+        data = f.read()
+    # only complete lines are kept
+    end = data.rfind(b'\n') + 1
+    lines = data[:end].decode().splitlines()
+    assert lines and json.loads(lines[0]).get('config') == config, \
+        'settings differ from the evaluation in %s: %s' % (path, lines[0] if lines else '')
+    results = [json.loads(line) for line in lines[1:]]
+    if end < len(data):
+        with open(path, 'r+b') as f:
+            f.truncate(end)
+    return results
+
+
+def evaluate(make_policy, output=None, episodes=1000, seed=0, horizon=5000, workers=None,
+             report=None, **env_kwargs):
+    """
+    Play a fixed suite of episodes with a policy across a pool of worker
+    processes and summarize their results. Episode k is played with seed
+    seed+k by the policy make_policy(seed+k), so results don't depend on
+    which worker plays it.
+    Inputs:
+        make_policy:    callable(seed) returning the policy of an episode, a
+                        callable(env, state) returning actions, it is sent to
+                        workers so it must be picklable where processes are
+                        spawned rather than forked
+        output:         JSON lines file of episode results, written as
+                        episodes end, if it exists the episodes in it are not
+                        played again, default=None keeps results in memory
+        episodes:       number of episodes of the suite, default=1000
+        seed:           seed of the first episode, default=0
+        horizon:        max number of steps of an episode, default=5000
+        workers:        number of worker processes, default is the number of
+                        cpus, 0 plays in this process
+        report:         seconds between progress reports printed to stdout,
+                        default=None doesn't report
+        env_kwargs:     arguments passed to Tetris, the backend defaults to
+                        bitboard
+    return:
+        summary of all episodes of the suite, see summarize
+    """
+    env_kwargs = dict({'backend': 'bitboard'}, **env_kwargs)
+    config = {'policy': policy_name(make_policy), 'seed': seed, 'horizon': horizon,
+              'env': env_kwargs}
+    results = []
+    if output is not None:
+        results = [r for r in load_results(output, config) if r['episode'] < episodes]
+    done = set(r['episode'] for r in results)
+    tasks = [(k, seed + k) for k in range(episodes) if k not in done]
+    out = open(output, 'a') if output is not None else None
+    start = last_report = time.time()
+    played = steps = 0
+    pool = None
+    try:
+        if workers == 0:
+            init_worker(make_policy, horizon, env_kwargs)
+            played_results = map(play_episode, tasks)
+        else:
+            workers = min(workers or mp.cpu_count(), max(len(tasks), 1))
+            pool = mp.Pool(workers, initializer=init_worker, initargs=(make_policy, horizon, env_kwargs))
+            played_results = pool.imap_unordered(play_episode, tasks)
+        for result in played_results:
+            results.append(result)
+            if out is not None:
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+            played += 1
+            steps += result['steps']
+            now = time.time()
+            if report is not None and now - last_report >= report:
+                print_progress(played, len(tasks), steps, now - start)
+                last_report = now
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if out is not None:
+            out.close()
+    if report is not None:
+        print_progress(played, len(tasks), steps, time.time() - start)
+    return summarize(results)
+
+
+def print_progress(played, total, steps, elapsed):
+    elapsed = max(elapsed, 1e-9)
+    print('%d of %d episodes %.1f episodes/s, %d actions %.0f actions/s' %
+          (played, total, played/elapsed, steps, steps/elapsed))
+    sys.stdout.flush()
+
+
+cmd_parser = argparse.ArgumentParser(description='Evaluate a policy on a fixed suite of seeded episodes.')
+cmd_parser.add_argument('output',
+                        help='JSON lines file of episode results, an evaluation is resumed if it exists.')
+cmd_parser.add_argument('-p', '--policy', default='random',
+                        help="'random', 'heuristic' or module:function called as function(seed), which "
+                             "returns the policy of an episode called as policy(env, state).")
+cmd_parser.add_argument('-e', '--episodes', default=1000, type=int,
+                        help='Number of episodes.')
+cmd_parser.add_argument('-s', '--seed', default=0, type=int,
+                        help='Episode k is played with seed+k.')
+cmd_parser.add_argument('-t', '--horizon', default=5000, type=int,
+                        help='Max number of steps for an episode, -1 means infinity.')
+cmd_parser.add_argument('-w', '--workers', default=None, type=int,
+                        help='Number of worker processes, default is the number of cpus.')
+cmd_parser.add_argument('-r', '--randomizer', default='uniform',
+                        help="Piece sequence, 'uniform' or 'bag'.")
+cmd_parser.add_argument('--report', default=5, type=float,
+                        help='Seconds between progress reports.')
+
+
+if __name__ == '__main__':
+    args = cmd_parser.parse_args()
+    # module:function policies are looked up from the working directory
+    sys.path.insert(0, os.getcwd())
+    summary = evaluate(load_policy(args.policy), args.output, episodes=args.episodes, seed=args.seed,
+                       horizon=args.horizon, workers=args.workers, report=args.report,
+                       randomizer=args.randomizer)
+    print('%d episodes, %.0f actions/s per worker' %
+          (summary['episodes'], summary['total_actions_per_second']))
+    for metric in METRICS:
+        s = summary[metric]
+        if not s['n']:
+            continue
+        print('%-20s mean %10.1f  95%% ci [%.1f, %.1f]  p5 %.1f  p50 %.1f  p95 %.1f' %
+              (metric, s['mean'], s['ci95'][0], s['ci95'][1], s['p5'], s['p50'], s['p95']))
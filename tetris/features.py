@@ -0,0 +1,189 @@
+import numpy as np
+from .tetromino import Blocks
+
+
+# features of boards, heights and wells have one value for every column:
+#   heights:            number of rows from the floor to the top block
+#   aggregate_height:   sum of heights
+#   max_height:         height of the highest column
+#   holes:              empty cells below the top block of their column
+#   bumpiness:          sum of height differences of adjacent columns
+#   wells:              depth of every column below its lower neighbor, the
+#                       walls are as high as the board
+#   row_transitions:    filled/empty changes between horizontally adjacent
+#                       cells, the walls are filled
+#   column_transitions: filled/empty changes between vertically adjacent
+#                       cells, the floor is filled
+def features_dtype(width=10):
+    """
+    Record dtype of features of boards with width columns.
+    """
+    return np.dtype([('heights', np.int32, width), ('aggregate_height', np.int32),
+                     ('max_height', np.int32), ('holes', np.int32), ('bumpiness', np.int32),
+                     ('wells', np.int32, width), ('row_transitions', np.int32),
+                     ('column_transitions', np.int32)])
+
+
+# features of the default 10 wide board
+FEATURES = features_dtype()
+
+# transitions of an empty row and an empty column
+EMPTY_ROW = 2
+EMPTY_COLUMN = 1
+
+
+def well_depths(heights, height=22):
+    """
+    Well depth of every column, heights can be a stack of boards, height is
+    the number of rows of the boards.
+    """
+    heights = np.asarray(heights)
+    wall = np.full(heights.shape[:-1]+(1,), height, dtype=heights.dtype)
+    left = np.concatenate((wall, heights[..., :-1]), axis=-1)
+    right = np.concatenate((heights[..., 1:], wall), axis=-1)
+    return np.maximum(np.minimum(left, right) - heights, 0)
+
+
+def row_transitions(filled):
+    """
+    Transitions of every row of (..., columns, rows) occupancy arrays.
+    """
+    edges = (~filled[..., 0, :]).astype(np.int32) + ~filled[..., -1, :]
+    return edges + np.count_nonzero(filled[..., 1:, :] != filled[..., :-1, :], axis=-2)
+
+
+def column_transitions(filled):
+    """
+    Transitions of every column of (..., columns, rows) occupancy arrays.
+    """
+    return (~filled[..., -1]).astype(np.int32) + \
+        np.count_nonzero(filled[..., 1:] != filled[..., :-1], axis=-1)
+
+
+def board_features(boards):
+    """
+    Features of one (width, height) board or of a stack of boards at once.
+    return:
+        features_dtype(width) record of the board, array of them for a stack
+        of boards
+    """
+    boards = np.asarray(boards)
+    width, height = boards.shape[-2:]
+    filled = boards.reshape((-1, width, height)) > 0
+    tops = np.where(filled.any(axis=2), filled.argmax(axis=2), height)
+    heights = height - tops
+    out = np.zeros(len(filled), dtype=features_dtype(width))
+    out['heights'] = heights
+    out['aggregate_height'] = heights.sum(axis=1)
+    out['max_height'] = heights.max(axis=1)
+    out['holes'] = out['aggregate_height'] - np.count_nonzero(filled, axis=(1, 2))
+    out['bumpiness'] = np.abs(np.diff(heights, axis=1)).sum(axis=1)
+    out['wells'] = well_depths(heights, height)
+    out['row_transitions'] = row_transitions(filled).sum(axis=1)
+    out['column_transitions'] = column_transitions(filled).sum(axis=1)
+    if boards.ndim == 2:
+        return out[0]
+    return out.reshape(boards.shape[:-2])
+
+
+class BoardFeatures(object):
+    """
+    Features of the main board of a Tetris env that are updated as pieces
+    land and lines are cleared. Filled cells of every column are counted in
+    place, transitions of rows and columns that changed are recounted when
+    features are read.
+    Inputs:
+        width:  number of columns of main board, default=10
+        height: number of rows of main board, default=22
+    """
+    def __init__(self, width=10, height=22):
+        self.width = width
+        self.height = height
+        self.reset()
+
+    def reset(self):
+        # if everything is recounted from the board when read
+        self.stale = False
+        self.filled = [0] * self.width
+        self.rows = [EMPTY_ROW] * self.height
+        self.columns = [EMPTY_COLUMN] * self.width
+        self.dirty_rows = set()
+        self.dirty_columns = set()
+
+    def load(self):
+        """
+        The board was changed directly, everything is recounted when
+        features are read.
+        """
+        self.stale = True
+
+    def recount(self, board):
+        filled = board > 0
+        self.filled = np.count_nonzero(filled, axis=1).tolist()
+        self.rows = row_transitions(filled).tolist()
+        self.columns = column_transitions(filled).tolist()
+        self.dirty_rows = set()
+        self.dirty_columns = set()
+        self.stale = False
+
+    def place(self, id, index, pos):
+        if self.stale:
+            return
+        for i, j, _ in Blocks[id][index]:
+            self.filled[pos[0]+i] += 1
+            self.dirty_columns.add(pos[0]+i)
+            self.dirty_rows.add(pos[1]+j)
+
+    def clear(self, lines):
+        """
+        Full lines were removed and the rows above them moved down.
+        """
+        if self.stale:
+            return
+        num = len(lines)
+        self.filled = [f - num for f in self.filled]
+        # lines are ascending, rows above every line move down by one
+        rows = self.rows
+        for j in lines:
+            del rows[j]
+            rows.insert(0, EMPTY_ROW)
+        self.dirty_rows = set(j + sum(1 for line in lines if line > j)
+                              for j in self.dirty_rows if j not in lines)
+        self.dirty_columns = set(range(self.width))
+
+    def update(self, board):
+        if self.stale:
+            self.recount(board)
+        if self.dirty_rows:
+            rows = sorted(self.dirty_rows)
+            for j, r in zip(rows, row_transitions(board[:, rows] > 0)):
+                self.rows[j] = int(r)
+            self.dirty_rows = set()
+        if self.dirty_columns:
+            columns = sorted(self.dirty_columns)
+            for i, c in zip(columns, column_transitions(board[columns] > 0)):
+                self.columns[i] = int(c)
+            self.dirty_columns = set()
+
+    def get(self, board, column_tops):
+        """
+        return:
+            dict of FEATURES fields, heights and wells are lists
+        """
+        self.update(board)
+        height = self.height
+        last = self.width - 1
+        heights = [height - top for top in column_tops]
+        aggregate = sum(heights)
+        return {
+            'heights': heights,
+            'aggregate_height': aggregate,
+            'max_height': max(heights),
+            'holes': aggregate - sum(self.filled),
+            'bumpiness': sum(abs(heights[i+1] - heights[i]) for i in range(last)),
+            'wells': [max(min(height if i == 0 else heights[i-1],
+                              height if i == last else heights[i+1]) - heights[i], 0)
+                      for i in range(last+1)],
+            'row_transitions': sum(self.rows),
+            'column_transitions': sum(self.columns),
+        }
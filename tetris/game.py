@@ -1,11 +1,23 @@
-import sys,os
-sys.path.append(os.path.join(os.path.dirname(__file__), "."))
-
+from collections import namedtuple
 from gym import Env
 from gym.spaces import Discrete
-from gym.spaces import Box
 import numpy as np
-from tetromino import Piece
+from .tetromino import Piece, Shapes, Bottoms, Blocks, Bounds, Rotations, spawn_position
+from .bitboard import BitBoard
+from .observation import ObservationBuffer, FORMATS, observation_space, observation_shape, \
+    queue_tiles, encode
+from .randomizer import Randomizer
+from .rgb import RGBRenderer
+from .features import BoardFeatures
+from .zobrist import zobrist_keys, piece_key, board_hash
+
+
+# A final position of a piece and the board after it is landed
+Placement = namedtuple('Placement', ['hold', 'index', 'pos', 'board', 'lines', 'reward'])
+
+# A snapshot of a game taken by Tetris.clone_state
+GameState = namedtuple('GameState', ['board', 'rows', 'column_tops', 'piece', 'held', 'next_queue',
+                                     'swapped', 'score', 'lines', 't', 'game_over', 'rng'])
 
 
 class Tetris(Env):
@@ -18,30 +30,94 @@ class Tetris(Env):
                                 default=5
         flattened_observation:  if provide flattened observation as 1D array
                                 rather than board and next queue, default=False
+        observation_format:     'int8' block values, 'packed' occupancy bits
+                                or 'onehot' channels of block values,
+                                default='int8'
+        seed:                   seed of the piece sequence, default=None
+                                seeds from system entropy
+        randomizer:             'uniform' draws every piece independently,
+                                'bag' draws permutations of all 7 pieces,
+                                default='uniform'
+        backend:                collision engine, 'numpy' checks cells of the
+                                board array, 'bitboard' keeps one bitmask per
+                                row of the board, default='numpy'
+        inplace_observation:    if observations are patched in one
+                                preallocated buffer, the returned array is
+                                overwritten by next steps, default=False
+        readonly_observation:   if the buffer of inplace_observation is
+                                returned as a read-only view, default=False
+        return_info:            if step, step_many and step_placement also
+                                return an info dict with the action_mask of
+                                next step, default=False
+        width:                  number of columns of main board, at least 4,
+                                default=10
+        height:                 number of rows of main board including
+                                hidden ones, default=22
+        hidden_rows:            number of top rows of main board that are
+                                not in observations, default=2
     Important Members:
         score:      score of current game
+        lines:      number of lines cleared in current game
         piece:      current tetromino piece that player is controlling
         held_piece: piece that in the hold queue
-        main_board: tetris game board (10x22), 2 rows are invisible to player
-        next_queue: shapes that will be spawned in next steps
+        main_board: tetris game board (width x height), hidden_rows rows are
+                    invisible to player
+        next_queue: shape ids that will be spawned in next steps, the last one
+                    is spawned first
+        column_tops: row index of the highest block of every column of main
+                     board, height if the column is empty
     """
-    def __init__(self, horizon=5000, flattened_observation=False):
+    metadata = {'render.modes': ['human', 'gui', 'rgb_array']}
+
+    def __init__(self, horizon=5000, flattened_observation=False, backend='numpy',
+                 inplace_observation=False, readonly_observation=False,
+                 observation_format='int8', seed=None, randomizer='uniform', return_info=False,
+                 width=10, height=22, hidden_rows=2):
+        assert backend in ('numpy', 'bitboard'), 'unknown backend: %s' % backend
+        assert observation_format in FORMATS, 'unknown observation format: %s' % observation_format
+        assert width >= 4 and height >= 4, 'main board must be at least 4x4'
+        assert 0 <= hidden_rows < height, 'hidden rows must leave visible rows'
+        self.width = width
+        self.height = height
+        self.hidden_rows = hidden_rows
+        # top/left position of spawned pieces, centered on main board
+        self.spawn = spawn_position(width)
+        self.keys = zobrist_keys(width, height)
         self.horizon = horizon
+        self.return_info = return_info
+        self.backend = backend
+        self.bitboard = BitBoard(width, height) if backend == 'bitboard' else None
+        self.board_features = BoardFeatures(width, height)
         self.t = 0
         self.next_queue_size = 5
         self.flattened_observation = flattened_observation
+        self.observation_format = observation_format
         self.action_space = Discrete(8)
-        if self.flattened_observation:
-            # it is 10*20 because player only can see 10*20 board, top 2 lines are hidden
-            self.observation_space = Box(0, 7, (10*20+4*4*self.next_queue_size,), np.int8)
-        else:
-            # it is 10*20 of main board, other 12 lines are next queue with padding
-            self.observation_space = Box(0, 7, (10,20+4*3), np.int8)
+        self.observation_space = observation_space(observation_format, flattened_observation,
+                                                    self.next_queue_size, width, height-hidden_rows)
         self.down_step_score = 1
+        self.randomizer_mode = randomizer
+        self.seed(seed)
+        # counters of main board and next queue changes
+        self.board_version = 0
+        self.queue_version = 0
+        self.observation = None
+        self.rgb_renderer = None
+        # Recorder that logs episodes, see recording.py
+        self.recorder = None
+        # Profiler that times phases of steps, see profiling.py
+        self.profiler = None
+        # action mask and the state it is for
+        self.action_mask = None
+        self.action_mask_key = None
+        if inplace_observation:
+            self.observation = ObservationBuffer(flattened_observation, readonly_observation,
+                                                 observation_format, width, height-hidden_rows)
         self.init_game()
 
     def init_game(self):
         self.score = 0
+        self.lines = 0
         self.t = 0
         self.piece = None
         self.held_piece = None
@@ -49,26 +125,58 @@ class Tetris(Env):
         self.game_over = False
         # flag that indicates if current piece is swapped of hold queue
         self.swapped = False
+        # placements enumerated by get_placements() and the state they are for
+        self.placements = []
+        self.placements_key = None
         # Initalize board
-        self.main_board = np.zeros(shape=(10,22), dtype=int)
-        # Initialize next queue
-        self.next_queue = []
-        for i in range(self.next_queue_size):
-            self.next_queue.append(Piece(np.random.randint(7)))
+        self.main_board = np.zeros(shape=(self.width, self.height), dtype=np.int8)
+        if self.bitboard is not None:
+            self.bitboard.reset()
+        self.board_features.reset()
+        # zobrist hash of main board, None if it has to be recomputed
+        self.board_hash = 0
+        self.column_tops = [self.height] * self.width
+        # landing position of current piece and the piece state it is for
+        self.ghost = None
+        self.ghost_key = None
+        self.board_version += 1
+        self.queue_version += 1
+        # next queue is a ring buffer of shape ids starting at queue_head,
+        # it is drawn from the piece sequence by reset
+        self.queue = [0] * self.next_queue_size
+        self.queue_head = 0
+
+    def seed(self, seed=None):
+        """
+        Restart the piece sequence from a seed, it applies to pieces drawn
+        from now on, including the next queue of next reset.
+        """
+        self.randomizer = Randomizer(seed, self.randomizer_mode)
+        return [self.randomizer.seed]
+
+    @property
+    def next_queue(self):
+        """
+        Shape ids of next queue, the last one is spawned first.
+        """
+        head = self.queue_head
+        return (self.queue[head:] + self.queue[:head])[::-1]
 
     def next_queue_state(self):
         """
         returns shapes in ndarray of next queue.
         """
-        nq = []
-        for s in self.next_queue:
-            s, _ = s.get()
-            nq.append(s)
-        return np.array(nq)
+        return np.array([Shapes[id][0] for id in self.next_queue], dtype=np.int8)
 
     def render(self, mode='human', close=False):
         if mode == 'gui':
             return self.look_board(), self.next_queue_state(), self.score
+        if mode == 'rgb_array':
+            # the renderer is created by the first frame, assign another
+            # RGBRenderer to rgb_renderer to change its block size
+            if self.rgb_renderer is None:
+                self.rgb_renderer = RGBRenderer()
+            return self.rgb_renderer.render(self)
         print("Main board:")
         print(np.rot90(self.look_board(), 3))
         print("Next queue:")
@@ -92,79 +200,381 @@ class Tetris(Env):
             state:      (main_board, next_queue)
             reward:     score increased by this action
             done:       if game over
+            info:       dict of action_mask, if return_info
+        """
+        reward = self.play_action(action)
+        if self.recorder is not None:
+            self.recorder.record_step(self, action, reward)
+        if self.return_info:
+            return self.get_observation(), reward, self.game_over, {'action_mask': self.get_action_mask()}
+        return self.get_observation(), reward, self.game_over
+
+    def step_many(self, actions, return_rewards=False):
+        """
+        Apply a sequence of actions like calling step for each of them, but
+        only the observation after the last one is built. It stops early
+        when the game is over, the rest of actions are not applied.
+        input:
+            actions:        sequence of actions, see step
+            return_rewards: if also return the reward of every applied action
+        return:
+            state:      observation after the actions
+            reward:     score increased by the actions
+            done:       if game over
+            rewards:    list of rewards of applied actions, if return_rewards
+            info:       dict of action_mask, if return_info
+        """
+        total = 0
+        rewards = []
+        for action in actions:
+            if self.game_over:
+                break
+            reward = self.play_action(action)
+            if self.recorder is not None:
+                self.recorder.record_step(self, action, reward)
+            total += reward
+            rewards.append(reward)
+        result = (self.get_observation(), total, self.game_over)
+        if return_rewards:
+            result += (rewards,)
+        if self.return_info:
+            result += ({'action_mask': self.get_action_mask()},)
+        return result
+
+    def get_action_mask(self):
+        """
+        Valid actions in current state: moves and rotations (with kicks)
+        that fit on main board, move down and hard drop which always move or
+        land the piece, and hold unless it was done for current piece. Noop
+        is always valid, step(0) is a played (and recorded) step, it is the
+        only valid action once the game is over.
+        return:
+            (8,) read-only bool array
+        """
+        piece = self.piece
+        if piece is None or self.game_over:
+            key = None
+        else:
+            key = (self.board_version, piece, piece.index, piece.x, piece.y, self.swapped)
+        if self.action_mask is not None and key == self.action_mask_key:
+            return self.action_mask
+        mask = np.zeros(8, dtype=bool)
+        mask[0] = True
+        if key is not None:
+            x, y = piece.x, piece.y
+            index = piece.index
+            mask[1] = self.check_move((x-1, y), index)
+            mask[2] = self.check_move((x+1, y), index)
+            mask[3] = mask[4] = True
+            if piece.orientation_num > 1:
+                for action, rotated in zip((5, 6), Rotations[piece.id][index]):
+                    mask[action] = (self.check_move((x, y), rotated) or
+                                    self.check_move((x+1, y), rotated) or
+                                    self.check_move((x-1, y), rotated))
+            mask[7] = not self.swapped
+        mask.flags.writeable = False
+        self.action_mask = mask
+        self.action_mask_key = key
+        return mask
+
+    def play_action(self, action):
+        """
+        Apply action to the game without building observation, see step.
+        return:
+            reward:     score increased by this action
         """
         reward = 0
-        if self.game_over or self.piece is None:
-            return self.get_observation(), reward, self.game_over
+        piece = self.piece
+        if self.game_over or piece is None:
+            return reward
+        # proposed position and orientation, from the shared tables of shapes
+        index, x, y = piece.index, piece.x, piece.y
         if action == 1:
-            shape, pos, index = self.piece.try_move_left()
+            x -= 1
         elif action == 2:
-            shape, pos, index = self.piece.try_move_right()
+            x += 1
         elif action == 3:
-            shape, pos, index = self.piece.try_move_down()
-            proposed_score = self.down_step_score
+            y += 1
         elif action == 4:
-            while True:
-                shape, pos, index = self.piece.try_move_down()
-                if self.check_piece(shape, pos):
-                    self.score += self.down_step_score
-                    reward += self.down_step_score
-                    self.piece.commit(pos, index)
-                else:
-                    break
+            ghost = self.get_ghost()
+            drop = ghost[1] - y
+            if drop > 0:
+                self.score += drop*self.down_step_score
+                reward += drop*self.down_step_score
+                y = ghost[1]
+                piece.commit((x, y), index)
+            y += 1
         elif action == 5:
-            shape, pos, index = self.piece.try_rotate_counter_clockwise()
+            index = Rotations[piece.id][index][0]
         elif action == 6:
-            shape, pos, index = self.piece.try_rotate_clockwise()
+            index = Rotations[piece.id][index][1]
         # hold queue operations
         elif action == 7:
-            # already swapped this turn, do nothing
-            if self.swapped:
-                pass
-            # hold queue is empty
-            elif self.held_piece is None:
-                self.piece.reset()
-                self.held_piece = self.piece
-                self.piece = None
-                self.spawn_piece()
-            else:
-                tmp = self.held_piece
-                self.piece.reset()
-                self.held_piece = self.piece
-                self.piece = tmp
-            shape, pos = self.piece.get()
-            index = self.piece.index
-            self.swapped = True
+            self.hold_piece()
+            piece = self.piece
+            index, x, y = piece.index, piece.x, piece.y
         # ignore other actions
         else:
-            return self.get_observation(), reward, self.game_over
-        if self.check_piece(shape, pos):
+            return reward
+        if self.check_move((x, y), index):
             self.score += reward
-            self.piece.commit(pos, index)
+            piece.commit((x, y), index)
         else:
             # move down failed, piece landed
             if action == 3 or action == 4:
-                s, p = self.piece.get()
-                reward += self.land_piece(s, p)
+                reward += self.land_piece(piece.pos)
             # rotate failed, check spins
             elif action == 5 or action == 6:
-                if self.check_piece(shape, (pos[0]+1, pos[1])):
-                    self.piece.commit((pos[0]+1, pos[1]), index)
-                elif self.check_piece(shape, (pos[0]-1, pos[1])):
-                    self.piece.commit((pos[0]-1, pos[1]), index)
+                if self.check_move((x+1, y), index):
+                    piece.commit((x+1, y), index)
+                elif self.check_move((x-1, y), index):
+                    piece.commit((x-1, y), index)
             # hold queue/dequeue failed, game over
             elif action == 7:
                 self.game_over = True
         self.t += 1
         if self.horizon >= 0 and self.t >= self.horizon:
             self.game_over = True
+        return reward
+
+    def hold_piece(self):
+        """
+        Swap current piece with the one in hold queue, current piece is put
+        in hold queue and next piece is spawned if hold queue is empty.
+        It can only be done once before current piece is landed.
+        """
+        # already swapped this turn, do nothing
+        if self.swapped:
+            pass
+        # hold queue is empty
+        elif self.held_piece is None:
+            self.piece.reset()
+            self.held_piece = self.piece
+            self.piece = None
+            self.spawn_piece()
+        else:
+            tmp = self.held_piece
+            self.piece.reset()
+            self.held_piece = self.piece
+            self.piece = tmp
+        self.swapped = True
+
+    def get_placements(self):
+        """
+        Enumerate all distinct final placements that current piece can reach
+        with move and rotate actions, and also the ones of the piece swapped
+        from hold queue if hold is allowed.
+        return:
+            list of Placement:
+                hold:       if hold queue is swapped before placing
+                index:      orientation index of the placed piece
+                pos:        [x, y] position of the placed piece
+                board:      main board after the piece landed and lines cleared
+                lines:      number of cleared lines
+                reward:     score bonus of cleared lines
+        """
+        self.placements = []
+        self.placements_key = (self.t, self.board_version, self.piece)
+        if self.game_over or self.piece is None:
+            return self.placements
+        self.search_placements(self.piece, False)
+        if not self.swapped:
+            if self.held_piece is None:
+                piece = Piece(self.queue[self.queue_head], self.spawn)
+            else:
+                piece = Piece(self.held_piece.id, self.spawn)
+            if self.check_move(piece.pos, piece.index, piece):
+                self.search_placements(piece, True)
+        return self.placements
+
+    def search_placements(self, piece, hold):
+        """
+        Search positions reachable from piece and add the landed ones to
+        placements.
+        """
+        rotations = Rotations[piece.id]
+        start = (piece.index, piece.x, piece.y)
+        seen = set([start])
+        frontier = [start]
+        landed = set()
+        while len(frontier) > 0:
+            index, x, y = frontier.pop()
+            nexts = []
+            if self.check_move((x, y+1), index, piece):
+                nexts.append((index, x, y+1))
+            else:
+                landed.add((index, x, y))
+            for dx in (-1, 1):
+                if self.check_move((x+dx, y), index, piece):
+                    nexts.append((index, x+dx, y))
+            for i in rotations[index]:
+                # same spins as step()
+                for dx in (0, 1, -1):
+                    if self.check_move((x+dx, y), i, piece):
+                        nexts.append((i, x+dx, y))
+                        break
+            for state in nexts:
+                if state not in seen:
+                    seen.add(state)
+                    frontier.append(state)
+        for index, x, y in sorted(landed):
+            board, lines = self.preview_landing(piece.id, index, (x, y))
+            self.placements.append(Placement(hold, index, [x, y], board, lines, self.line_bonus(lines)))
+
+    def preview_landing(self, id, index, pos):
+        """
+        Compute main board after a piece is landed without changing the game.
+        return:
+            board:  main board with the piece and full lines removed
+            lines:  number of cleared lines
+        """
+        board = self.main_board.copy()
+        for i, j, v in Blocks[id][index]:
+            board[pos[0]+i, pos[1]+j] = v
+        full = (board > 0).all(axis=0)
+        lines = int(full.sum())
+        if lines > 0:
+            board[:, lines:] = board[:, ~full]
+            board[:, :lines] = 0
+        return board, lines
+
+    def step_placement(self, i):
+        """
+        Place current piece at i-th placement returned by get_placements()
+        and land it, this counts as one step.
+        return:
+            state:      observation after the piece is landed
+            reward:     score increased by cleared lines
+            done:       if game over
+            info:       dict of action_mask, if return_info
+        """
+        reward = 0
+        if not self.game_over and self.piece is not None:
+            if self.recorder is not None:
+                self.recorder.check_placement(i)
+            reward = self.play_placement(i)
+            if self.recorder is not None:
+                self.recorder.record_placement(self, i, reward)
+        if self.return_info:
+            return self.get_observation(), reward, self.game_over, {'action_mask': self.get_action_mask()}
         return self.get_observation(), reward, self.game_over
 
+    def play_placement(self, i):
+        """
+        Land current piece at i-th placement like step_placement without
+        building an observation.
+        return:
+            score increased by cleared lines
+        """
+        if self.placements_key != (self.t, self.board_version, self.piece):
+            self.get_placements()
+        placement = self.placements[i]
+        if placement.hold:
+            self.hold_piece()
+        self.piece.commit(list(placement.pos), placement.index)
+        reward = self.land_piece(self.piece.pos)
+        self.t += 1
+        if self.horizon >= 0 and self.t >= self.horizon:
+            self.game_over = True
+        return reward
+
     def reset(self):
+        rng = self.randomizer.get_state()
         self.init_game()
+        self.queue = [self.randomizer.next() for i in range(self.next_queue_size)]
         self.spawn_piece()
+        if self.recorder is not None:
+            self.recorder.record_reset(self, rng)
         return self.get_observation()
 
+    def clone_state(self, rng=True):
+        """
+        Take a snapshot of current game, it can be restored by restore_state.
+        input:
+            rng:    if save the state of the random generator of pieces
+        return:
+            GameState:
+                board:          bytes of main board
+                rows:           row masks of bitboard backend, None otherwise
+                column_tops:    tuple of column tops
+                piece:          (id, index, x, y) of current piece or None
+                held:           shape id of held piece or None
+                next_queue:     tuple of shape ids of next queue
+                swapped, score, lines, t, game_over: same as members
+                rng:            randomizer state or None
+        """
+        piece = None
+        if self.piece is not None:
+            piece = (self.piece.id, self.piece.index, self.piece.x, self.piece.y)
+        return GameState(
+            self.main_board.tobytes(),
+            tuple(self.bitboard.rows) if self.bitboard is not None else None,
+            tuple(self.column_tops),
+            piece,
+            self.held_piece.id if self.held_piece is not None else None,
+            tuple(self.next_queue),
+            self.swapped,
+            self.score,
+            self.lines,
+            self.t,
+            self.game_over,
+            self.randomizer.get_state() if rng else None)
+
+    def restore_state(self, state):
+        """
+        Restore game to a snapshot taken by clone_state.
+        """
+        self.main_board[:] = np.frombuffer(state.board, dtype=np.int8).reshape(self.width, self.height)
+        if self.bitboard is not None:
+            if state.rows is not None:
+                self.bitboard.rows = list(state.rows)
+            else:
+                self.bitboard.load(self.main_board)
+        self.column_tops = list(state.column_tops)
+        self.board_features.load()
+        self.board_hash = None
+        self.piece = None
+        if state.piece is not None:
+            id, index, x, y = state.piece
+            self.piece = Piece(id, self.spawn)
+            self.piece.commit((x, y), index)
+        self.held_piece = Piece(state.held, self.spawn) if state.held is not None else None
+        self.queue = list(state.next_queue[::-1])
+        self.queue_head = 0
+        self.swapped = state.swapped
+        self.score = state.score
+        self.lines = state.lines
+        self.t = state.t
+        self.game_over = state.game_over
+        self.placements = []
+        self.placements_key = None
+        self.ghost_key = None
+        self.board_version += 1
+        self.queue_version += 1
+        if state.rng is not None:
+            self.randomizer.set_state(state.rng)
+
+    def __getstate__(self):
+        config = {
+            'horizon': self.horizon,
+            'flattened_observation': self.flattened_observation,
+            'backend': self.backend,
+            'inplace_observation': self.observation is not None,
+            'readonly_observation': self.observation is not None and self.observation.readonly,
+            'observation_format': self.observation_format,
+            'seed': self.randomizer.seed,
+            'randomizer': self.randomizer_mode,
+            'return_info': self.return_info,
+            'width': self.width,
+            'height': self.height,
+            'hidden_rows': self.hidden_rows,
+        }
+        return {'config': config, 'state': self.clone_state()}
+
+    def __setstate__(self, state):
+        self.__init__(**state['config'])
+        self.restore_state(state['state'])
+
     def get_score(self):
         return self.score
 
@@ -172,39 +582,56 @@ class Tetris(Env):
         """
         Convert observation to desired shape
         """
+        if self.observation is not None:
+            return self.observation.update(self)
         if self.flattened_observation:
-            return np.concatenate((self.look_board().reshape(-1,), self.next_queue_state().reshape(-1,)))
-        nq = self.next_queue_state()
-        nq_1 =  np.pad(np.concatenate((nq[0], nq[1]), axis=0), ((0,2),(0,0)),'constant')
-        nq_2 =  np.pad(np.concatenate((nq[2], nq[3]), axis=0), ((0,2),(0,0)),'constant')
-        nq_3 =  np.pad(nq[4], ((0,6),(0,0)),'constant')
-        out = np.concatenate((self.look_board(), nq_1, nq_2, nq_3), axis=1)
-        return out.reshape(1, out.shape[0], -1)
+            out = np.concatenate((self.look_board().reshape(-1,), self.next_queue_state().reshape(-1,)))
+        else:
+            visible = self.height - self.hidden_rows
+            out = np.zeros((1,)+observation_shape(self.width, visible, self.next_queue_size), dtype=np.int8)
+            out[0, :, :visible] = self.look_board()
+            tiles = queue_tiles(self.width, visible, self.next_queue_size)
+            for (x, y), tile in zip(tiles, self.next_queue_state()):
+                out[0, x:x+4, y:y+4] = tile
+        return encode(out, self.observation_format, self.flattened_observation)
 
     def spawn_piece(self):
         if self.game_over:
             return
         assert self.piece == None, "double piece exisitence"
-        self.piece = self.next_queue.pop()
-        self.next_queue.insert(0, Piece(np.random.randint(7)))
-        shape, pos = self.piece.get()
-        if not self.check_piece(shape, pos):
+        self.piece = Piece(self.queue[self.queue_head], self.spawn)
+        self.queue[self.queue_head] = self.randomizer.next()
+        self.queue_head = (self.queue_head + 1) % self.next_queue_size
+        self.queue_version += 1
+        if not self.check_move(self.piece.pos, self.piece.index):
             self.game_over = True
 
-    def land_piece(self, shape, pos):
+    def land_piece(self, pos):
         """
         piece landed to board, this can happen when piece try to move down.
         save info to board and check clear lines.
         input:
-            shape:  ndarray that represents the shape
-            pos:    the top/left piece position on board
+            pos:    the top/left position of current piece on board
         return:
             bonus:  score increased by this land_piece action
         """
-        for i, line in enumerate(shape):
-            for j, v in enumerate(line):
-                if v > 0:
-                    self.main_board[pos[0]+i, pos[1]+j] = v
+        id, index = self.piece.id, self.piece.index
+        blocks = Blocks[id][index]
+        tops = self.column_tops
+        for i, j, v in blocks:
+            x, y = pos[0]+i, pos[1]+j
+            self.main_board[x, y] = v
+            if y < tops[x]:
+                tops[x] = y
+        if self.bitboard is not None:
+            self.bitboard.place(id, index, pos)
+        self.board_features.place(id, index, pos)
+        if self.board_hash is not None:
+            keys = self.keys.cells
+            for i, j, v in blocks:
+                self.board_hash ^= int(keys[pos[0]+i, pos[1]+j, v])
+        self.ghost_key = None
+        self.board_version += 1
         bonus = self.clear_lines(pos)
         self.piece = None
         # reset hold queue flag
@@ -217,27 +644,99 @@ class Tetris(Env):
         check board to see if there are lines need to be cleared
         return score increased by this land_piece action
         """
-        top = pos[1]
-        lines = []
-        for j in range(top, min(top+4, 22)):
-            for i in range(0, 10):
-                if self.main_board[i, j] == 0:
-                    break
-                if i == 9 and self.main_board[i, j] > 0:
-                    lines.append(j)
+        top = max(pos[1], 0)
+        if self.bitboard is not None:
+            lines = self.bitboard.full_lines(top, top+4)
+        else:
+            full = (self.main_board[:, top:top+4] > 0).all(axis=0)
+            lines = [top+j for j in np.flatnonzero(full).tolist()]
         clear_num = len(lines)
         if clear_num == 0:
             return 0
-        for j in reversed(range(0, lines[-1]+1)):
-            if j > clear_num-1:
-                for i in range(0, 10):
-                    self.main_board[i, j] = self.main_board[i, j-clear_num]
-            else:
-                for i in range(0, 10):
-                    self.main_board[i, j] = 0
+        self.lines += clear_num
+        if self.bitboard is not None:
+            self.bitboard.clear_lines(lines)
+        # rows above the surface are empty, only shift the kept rows between
+        # the surface and the last line, lines are not always adjacent
+        surface = min(self.column_tops)
+        bottom = lines[-1]+1
+        keep = [j for j in range(surface, bottom) if j not in lines]
+        self.main_board[:, surface+clear_num:bottom] = self.main_board[:, keep]
+        self.main_board[:, surface:surface+clear_num] = 0
+        self.board_features.clear(lines)
+        self.board_hash = None
+        self.update_column_tops(surface+clear_num, bottom)
         return self.scoring(clear_num)
 
+    def update_column_tops(self, top=0, bottom=None):
+        """
+        Find column tops after rows [top, bottom) of main board changed, the
+        rows above top must be empty. Columns without blocks in these rows
+        are scanned below them, by default the whole board is scanned.
+        """
+        if bottom is None:
+            bottom = self.height
+        # rows from the first one that can have blocks, at least one of them
+        top = min(top, bottom-1)
+        occupied = self.main_board[:, top:bottom] > 0
+        found = occupied.any(axis=1)
+        tops = np.where(found, top + occupied.argmax(axis=1), self.height)
+        # columns emptied down to bottom, their top is further below
+        for x in np.flatnonzero(~found):
+            below = np.flatnonzero(self.main_board[x, bottom:])
+            if len(below) > 0:
+                tops[x] = bottom + below[0]
+        self.column_tops = tops.tolist()
+
+    def sync_board(self):
+        """
+        Rebuild the states derived from main board after it is modified
+        directly.
+        """
+        if self.bitboard is not None:
+            self.bitboard.load(self.main_board)
+        self.board_features.load()
+        self.board_hash = None
+        self.update_column_tops()
+        self.ghost_key = None
+        self.board_version += 1
+
+    def get_features(self):
+        """
+        Features of main board without current piece, they are kept up to
+        date as pieces land, see features.py for their definitions.
+        return:
+            dict of heights, aggregate_height, max_height, holes, bumpiness,
+            wells, row_transitions and column_transitions
+        """
+        return self.board_features.get(self.main_board, self.column_tops)
+
+    def get_hash(self):
+        """
+        64 bit zobrist hash of main board, current piece, held piece and
+        swapped flag, the next queue is not included. The parts are kept
+        up to date as the game goes, main board is only rehashed after
+        lines are cleared.
+        """
+        if self.board_hash is None:
+            self.board_hash = board_hash(self.main_board)
+        keys = self.keys
+        h = self.board_hash ^ keys.held[self.held_piece.id if self.held_piece is not None else 7]
+        if self.piece is not None:
+            h ^= piece_key(self.piece.id, self.piece.index, self.piece.pos, keys)
+        if self.swapped:
+            h ^= keys.swapped
+        return h
+
     def scoring(self, num_lines, type='basic'):
+        bonus = self.line_bonus(num_lines, type)
+        self.score += bonus
+        return bonus
+
+    def line_bonus(self, num_lines, type='basic'):
+        """
+        Score bonus of clearing num_lines lines at once.
+        """
         bonus = 0
         if type == 'basic':
             if num_lines == 1:
@@ -248,32 +747,95 @@ class Tetris(Env):
                 bonus = 300
             elif num_lines == 4:
                 bonus = 1200
-        self.score += bonus
         return bonus
 
     def look_board(self):
         """
         look at main board with current moving piece.
-        only returns board that visible to player (10x20)
+        only returns board that visible to player (width x visible rows)
         """
         board = self.main_board.copy()
         if self.piece is not None and self.game_over is False:
-            shape, pos = self.piece.get()
-            for i, line in enumerate(shape):
-                for j, v in enumerate(line):
-                    if v > 0:
-                        assert board[pos[0]+i, pos[1]+j] == 0, 'piece conflict on board'
-                        board[pos[0]+i, pos[1]+j] = v
-        return board[:,2:]
+            x, y = self.piece.x, self.piece.y
+            for i, j, v in Blocks[self.piece.id][self.piece.index]:
+                assert board[x+i, y+j] == 0, 'piece conflict on board'
+                board[x+i, y+j] = v
+        return board[:,self.hidden_rows:]
 
     def check_boundry(self, x, y):
         """
         Check if piece is outside of board boundary.
         """
-        if x >= 0 and x <= 9 and y >= 0 and y <= 21:
+        if x >= 0 and x < self.width and y >= 0 and y < self.height:
             return True
         return False
 
+    def get_ghost(self):
+        """
+        Landing position of current piece if it is hard dropped, it is cached
+        until current piece or main board changes.
+        return:
+            [x, y] of the landing position, None if there is no piece
+        """
+        if self.piece is None or self.game_over:
+            return None
+        piece = self.piece
+        key = (piece, piece.index, piece.x, piece.y)
+        if self.ghost_key != key:
+            pos = (piece.x, piece.y)
+            self.ghost = [pos[0], pos[1] + self.drop_distance(pos, piece.index)]
+            self.ghost_key = key
+        return self.ghost
+
+    def drop_distance(self, pos, index, piece=None):
+        """
+        Number of rows a piece can move down from a valid position.
+        It is computed from bottom profile of the piece and column tops,
+        unless the piece is under an overhang.
+        """
+        if piece is None:
+            piece = self.piece
+        tops = self.column_tops
+        dist = self.height
+        for i, j in Bottoms[piece.id][index]:
+            top = tops[pos[0]+i]
+            if top <= pos[1]+j:
+                break
+            dist = min(dist, top-pos[1]-j-1)
+        else:
+            return dist
+        # piece is below the surface, move it down step by step
+        dist = 0
+        while self.check_move((pos[0], pos[1]+dist+1), index, piece):
+            dist += 1
+        return dist
+
+    def check_move(self, pos, index, piece=None):
+        """
+        Check if a piece is valid on main board with a proposed position
+        and orientation, as returned by the piece try_* calls.
+        input:
+            pos:        [x, y] of the top-left block location
+            index:      orientation index of the piece
+            piece:      the piece to check, default is current piece
+        return:
+            True if valid False otherwise
+        """
+        if piece is None:
+            piece = self.piece
+        if self.bitboard is not None:
+            return self.bitboard.fits(piece.id, index, pos)
+        # bounding box first, then the 4 blocks
+        x, y = pos
+        xmin, xmax, ymin, ymax = Bounds[piece.id][index]
+        if x+xmin < 0 or x+xmax >= self.width or y+ymin < 0 or y+ymax >= self.height:
+            return False
+        board = self.main_board
+        for i, j, _ in Blocks[piece.id][index]:
+            if board[x+i, y+j] > 0:
+                return False
+        return True
+
     def check_piece(self, shape, pos):
         """
         Check if piece is valid on main board.
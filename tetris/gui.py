@@ -1,26 +1,94 @@
-import sys,os
-sys.path.append(os.path.join(os.path.dirname(__file__), "."))
-
 import tkinter as tk
 from tkinter import Canvas, Label, Tk, Text, Menu
-from game import Tetris
+from .game import Tetris
+from .tetromino import Blocks
 import numpy as np
 import time
 import threading
+from .colors import BLACK, COLORS
 
 GUI_WIDTH = 800
 GUI_HEIGHT = 800
 # Frame per second
 FPS=30
 
-RED         = "#eb3323"
-GREEN       = "#7ea956"
-BLUE        = "#4d73bc"
-LIGHTBLUE   = "#73fbfd"
-YELLOW      = "#f5c142"
-ORANGE      = "#e08244"
-PURPLE      = "#693799"
-BLACK       = "#000000"
+# cell codes of ghost piece blocks are GHOST+block value
+GHOST = 7
+# outline and fill colors indexed by cell codes
+OUTLINES = COLORS + COLORS[1:]
+FILLS = COLORS + [BLACK]*7
+# actions of keys in human and remote modes
+KEY_ACTIONS = {'a': 1, 's': 3, 'd': 2, 'w': 4, 'j': 5, 'k': 6, 'l': 7}
+
+class Spectator(object):
+    """
+    Tetris env that publishes snapshots of its game for a GUI watching it
+    from another thread. A snapshot is only taken when the GUI asked for a
+    new frame, so stepping costs one flag check while nobody is looking.
+    Other members are forwarded to the wrapped env.
+    Inputs:
+        env:            Tetris env played by the agent
+        render_every:   only states after every k-th step are published,
+                        default=1
+    Important Members:
+        snapshot:       GameState of the latest published state, it is
+                        immutable and replaced by new ones
+    """
+    def __init__(self, env, render_every=1):
+        assert render_every >= 1, 'render_every must be positive'
+        self.env = env
+        self.render_every = render_every
+        self.steps = 0
+        self.snapshot = None
+        # set by the GUI when it drew the last snapshot
+        self.requested = True
+
+    def __getattr__(self, name):
+        return getattr(self.env, name)
+
+    def publish(self):
+        self.requested = False
+        # replacing the reference is atomic, readers never see a partial state
+        self.snapshot = self.env.clone_state(rng=False)
+
+    def request(self):
+        self.requested = True
+
+    def reset(self):
+        state = self.env.reset()
+        self.publish()
+        return state
+
+    def step(self, action):
+        return self.published(self.env.step(action))
+
+    def step_many(self, actions, return_rewards=False):
+        # one call counts as one step
+        return self.published(self.env.step_many(actions, return_rewards))
+
+    def step_placement(self, i):
+        return self.published(self.env.step_placement(i))
+
+    def play_action(self, action):
+        reward = self.env.play_action(action)
+        self.stepped(self.env.game_over)
+        return reward
+
+    def play_placement(self, i):
+        reward = self.env.play_placement(i)
+        self.stepped(self.env.game_over)
+        return reward
+
+    def published(self, result):
+        self.stepped(result[2])
+        return result
+
+    def stepped(self, done):
+        self.steps += 1
+        # last state of a game is always shown
+        if done or (self.requested and self.steps % self.render_every == 0):
+            self.publish()
+
 
 class GameGUI(object):
     """
@@ -28,20 +96,49 @@ class GameGUI(object):
     modes:
         human:      interactive mode played by human
         agent:      played by RL agents
+        spectator:  played by RL agents at full speed in another thread,
+                    the GUI draws the latest snapshot of the game at FPS
+        remote:     played by human on a GameServer, keys are sent to the
+                    server which drops the pieces, the GUI draws the latest
+                    state received from it
+    Inputs:
+        render_every:   in spectator mode, only draw states after every k-th
+                        step, default=1
+        width, height, hidden_rows: size of main board, see Tetris, blocks
+                        are scaled so that the board fits the window
+        address:        in remote mode, (host, port) or Unix socket path of
+                        the server
     """
-    def __init__(self, horizon=-1, drop_interval=1000, mode='human'):
+    def __init__(self, horizon=-1, drop_interval=1000, mode='human', render_every=1,
+                 width=10, height=22, hidden_rows=2, address=None):
         # Init tetris game core
-        self.tetris = Tetris(horizon)
+        board = {'width': width, 'height': height, 'hidden_rows': hidden_rows}
+        self.tetris = Tetris(horizon, **board)
         self.mode = mode
+        self.spectator = None
+        if mode == 'spectator':
+            # self.tetris only shows snapshots of the env played by the agent
+            self.spectator = Spectator(Tetris(horizon, **board), render_every)
+        elif mode == 'remote':
+            from .server import Client, RemoteSession
+            client = Client(address)
+            session = client.open(horizon, gravity=drop_interval, **board)
+            # shown like a spectator, from the states sent by the server
+            self.spectator = RemoteSession(client, session)
+        # snapshot that self.tetris is restored to
+        self.shown_snapshot = None
         self.game_started = False
         self.drop_interval = drop_interval
         self.first_game = True
-        self.next_queue_items = []
         self.game_over_banner = None
         self.shape_block_border = int(GUI_HEIGHT/400)
         self.shape_block_unit = int(GUI_HEIGHT/20)
         self.shape_block_size = int(GUI_HEIGHT/20) - 2*self.shape_block_border
         self.next_queue_offset = self.shape_block_unit*4+2*self.shape_block_border
+        # blocks of main board are smaller if it doesn't fit in its canvas
+        self.board_size = (width, height-hidden_rows)
+        self.board_block_unit = min(self.shape_block_unit, int(GUI_HEIGHT/(height-hidden_rows)),
+                                    int(GUI_WIDTH/2/width))
 
     def init_gui(self):
         # Init windows and tetris board canvas
@@ -78,7 +175,7 @@ w : hard drop
 j : rotate counter-clockwise
 k : rotate clockwise
 l : hold"""
-        if self.mode == 'human':
+        if self.mode in ('human', 'remote'):
             self.side_board.create_text(int(GUI_WIDTH*11/32), 80, text=help_text)
         # Display score
         self.score = self.side_board.create_text(int(GUI_WIDTH/4), GUI_HEIGHT-12,
@@ -100,14 +197,19 @@ l : hold"""
                             self.shape_block_unit*4,
                             self.shape_block_unit*4+2*self.next_queue_offset,
                             outline=BLACK, fill=BLACK)
+        self.init_cells()
         # Bind events
-        if self.mode == 'human':
+        if self.mode in ('human', 'remote'):
             self.window.bind("<KeyPress>", self.gui_key_stroke)
 
     def close(self):
         self.window.destroy()
+        if self.mode == 'remote':
+            self.spectator.client.close()
 
     def get_env(self):
+        if self.spectator is not None:
+            return self.spectator
         return self.tetris
 
     def update_score(self):
@@ -115,138 +217,131 @@ l : hold"""
         self.side_board.itemconfig(self.score, text=score_str)
 
     def gui_key_stroke(self, key):
-        if key.char == 'a':
-            #print("move left")
-            _, _, done = self.tetris.step(1)
-        elif key.char == 's':
-            #print("move down")
-            _, _, done = self.tetris.step(3)
-        elif key.char == 'd':
-            #print("move right")
-            _, _, done = self.tetris.step(2)
-        elif key.char == 'w':
-            #print("hard drop")
-            _, _, done = self.tetris.step(4)
-        elif key.char == 'j':
-            #print("rotate counter clock-wise")
-            _, _, done = self.tetris.step(5)
-        elif key.char == 'k':
-            #print("rotate clock-wise")
-            _, _, done = self.tetris.step(6)
-        elif key.char == 'l':
-            #print("hold")
-            _, _, done = self.tetris.step(7)
-        else:
+        action = KEY_ACTIONS.get(key.char)
+        if action is None:
             return
+        if self.mode == 'remote':
+            # game over is shown with the state sent back by the server
+            self.spectator.step(action)
+            return
+        _, _, done = self.tetris.step(action)
         if done:
             self.game_over()
 
+    def cell_bounds(self, x, y, top_offset=0, unit=None):
+        # blocks of unit pixels have a border of 1/20 of them
+        if unit is None:
+            unit = self.shape_block_unit
+        border = max(unit//20, 1)
+        left = unit*x+border
+        right = left+unit-3*border
+        top = unit*y+border+top_offset
+        bottom = top+unit-3*border
+        return left, top, right, bottom
+
+    def init_cells(self):
+        # rectangles of main board and next queue are created once and
+        # recolored by draw calls, cell codes are drawn ones
+        width, visible = self.board_size
+        self.board_cells = [[self.main_board.create_rectangle(
+                                *self.cell_bounds(i, j, unit=self.board_block_unit),
+                                outline=OUTLINES[0], fill=FILLS[0])
+                             for j in range(visible)] for i in range(width)]
+        self.board_codes = np.zeros(self.board_size, dtype=np.int8)
+        self.queue_cells = [[[self.side_board.create_rectangle(
+                                *self.cell_bounds(i, j, queueid*self.next_queue_offset),
+                                outline=OUTLINES[0], fill=FILLS[0])
+                              for j in range(4)] for i in range(4)] for queueid in range(3)]
+        self.queue_codes = np.zeros((3, 4, 4), dtype=np.int8)
+        # state of the game when last frame was drawn
+        self.drawn_key = None
+
     def draw_mainboard(self, main_board):
-        # first delete all old items on main board
-        self.main_board.delete(tk.ALL)
-        # draw rectangles according to game state
-        for i, v in enumerate(main_board):
-            for j, c in enumerate(v):
-                left = self.shape_block_unit*i+self.shape_block_border
-                right = left+self.shape_block_size-self.shape_block_border
-                top = self.shape_block_unit*j+self.shape_block_border
-                bottom = top+self.shape_block_size-self.shape_block_border
-                # Line of four
-                if c == 1:
-                    self.main_board.create_rectangle(left, top, right, bottom,
-                        outline=BLUE, fill=BLUE)
-                # S-shape (orientation 1)
-                elif c == 2:
-                    self.main_board.create_rectangle(left, top, right, bottom,
-                        outline=RED, fill=RED)
-                # S-shape (orientation 2)
-                elif c == 3:
-                    self.main_board.create_rectangle(left, top, right, bottom,
-                        outline=LIGHTBLUE, fill=LIGHTBLUE)
-                # T-shape
-                elif c == 4:
-                    self.main_board.create_rectangle(left, top, right, bottom,
-                        outline=ORANGE, fill=ORANGE)
-                # L-shape (orientation 1)
-                elif c == 5:
-                    self.main_board.create_rectangle(left, top, right, bottom,
-                        outline=GREEN, fill=GREEN)
-                # L-shape (orientation 2)
-                elif c == 6:
-                    self.main_board.create_rectangle(left, top, right, bottom,
-                        outline=PURPLE, fill=PURPLE)
-                # Cube
-                elif c == 7:
-                    self.main_board.create_rectangle(left, top, right, bottom,
-                        outline=YELLOW, fill=YELLOW)
-                else:
-                    self.main_board.create_rectangle(left, top, right, bottom,
-                        fill="black")
+        codes = main_board.astype(np.int8)
+        self.add_ghost(codes)
+        # only recolor cells that changed since last frame
+        for i, j in zip(*np.nonzero(codes != self.board_codes)):
+            c = codes[i, j]
+            self.main_board.itemconfig(self.board_cells[i][j], outline=OUTLINES[c], fill=FILLS[c])
+        self.board_codes = codes
+
+    def add_ghost(self, codes):
+        # outline where current piece will land if it is hard dropped
+        ghost = self.tetris.get_ghost()
+        if ghost is None:
+            return
+        piece = self.tetris.piece
+        for i, j, c in Blocks[piece.id][piece.index]:
+            x, y = ghost[0]+i, ghost[1]+j-self.tetris.hidden_rows
+            # hidden rows or overlapped by current piece
+            if y < 0 or codes[x, y] > 0:
+                continue
+            codes[x, y] = GHOST+c
 
     def draw_nextqueue(self, next_queue):
-        # first clear old items
-        for i in self.next_queue_items:
-            self.side_board.delete(i)
-        self.next_queue_items.clear()
-        # draw rectangles according to game state
-        for queueid in range(1,4):
-            shape = next_queue[-1*queueid]
-            for i, line in enumerate(shape):
-                for j, c in enumerate(line):
-                    left = self.shape_block_unit*i+self.shape_block_border
-                    right = left+self.shape_block_size-self.shape_block_border
-                    top = self.shape_block_unit*j+self.shape_block_border+(queueid-1)*self.next_queue_offset
-                    bottom = top+self.shape_block_size-self.shape_block_border
-                    item = None
-                    # Line of four
-                    if c == 1:
-                        item = self.side_board.create_rectangle(left, top, right, bottom,
-                            outline=BLUE, fill=BLUE)
-                    # S-shape (orientation 1)
-                    elif c == 2:
-                        item = self.side_board.create_rectangle(left, top, right, bottom,
-                            outline=RED, fill=RED)
-                    # S-shape (orientation 2)
-                    elif c == 3:
-                        item = self.side_board.create_rectangle(left, top, right, bottom,
-                            outline=LIGHTBLUE, fill=LIGHTBLUE)
-                    # T-shape
-                    elif c == 4:
-                        item = self.side_board.create_rectangle(left, top, right, bottom,
-                            outline=ORANGE, fill=ORANGE)
-                    # L-shape (orientation 1)
-                    elif c == 5:
-                        item = self.side_board.create_rectangle(left, top, right, bottom,
-                            outline=GREEN, fill=GREEN)
-                    # L-shape (orientation 2)
-                    elif c == 6:
-                        item = self.side_board.create_rectangle(left, top, right, bottom,
-                            outline=PURPLE, fill=PURPLE)
-                    # Cube
-                    elif c == 7:
-                        item = self.side_board.create_rectangle(left, top, right, bottom,
-                            outline=YELLOW, fill=YELLOW)
-                    if item is not None:
-                        self.next_queue_items.append(item)
+        codes = np.array([next_queue[-1*queueid] for queueid in range(1,4)], dtype=np.int8)
+        for q, i, j in zip(*np.nonzero(codes != self.queue_codes)):
+            c = codes[q, i, j]
+            self.side_board.itemconfig(self.queue_cells[q][i][j], outline=OUTLINES[c], fill=FILLS[c])
+        self.queue_codes = codes
+
+    def frame_key(self):
+        t = self.tetris
+        piece = None
+        if t.piece is not None:
+            piece = (t.piece, t.piece.index, t.piece.x, t.piece.y)
+        return (t.board_version, t.queue_version, piece, t.score, t.game_over)
+
     def draw(self):
         last_run = time.time() * 1000
+        if self.spectator is not None:
+            self.show_snapshot()
         if self.game_started:
-            mb, nq, score = self.tetris.render(mode='gui')
-            self.draw_mainboard(mb)
-            self.draw_nextqueue(nq)
-            self.update_score()
+            key = self.frame_key()
+            # skip the frame if nothing changed
+            if key != self.drawn_key:
+                mb, nq, score = self.tetris.render(mode='gui')
+                self.draw_mainboard(mb)
+                self.draw_nextqueue(nq)
+                self.update_score()
+                self.drawn_key = key
         draw_time = time.time() * 1000 - last_run
         next_run = max(int(1000/FPS-draw_time), 0)
         self.window.after(next_run, self.draw)
 
+    def show_snapshot(self):
+        snapshot = self.spectator.snapshot
+        self.spectator.request()
+        if snapshot is None or snapshot is self.shown_snapshot:
+            return
+        self.tetris.restore_state(snapshot)
+        self.shown_snapshot = snapshot
+        self.game_started = True
+        if snapshot.game_over and self.game_over_banner is None:
+            self.show_game_over()
+        elif not snapshot.game_over and self.game_over_banner is not None:
+            self.main_board.delete(self.game_over_banner)
+            self.game_over_banner = None
+
     def auto_drop(self):
         self.tetris.step(3)
         self.window.after(self.drop_interval, self.auto_drop)
 
-    def play(self):
+    def play(self, agent=None):
+        """
+        Open the window, in spectator mode agent(env) is run in a daemon
+        thread with the env of get_env() while the GUI watches it, and this
+        call returns when the window is closed.
+        """
         self.init_gui()
         self.draw()
-        if self.mode == 'human':
+        if self.mode in ('human', 'remote'):
+            self.window.mainloop()
+        elif self.mode == 'spectator':
+            if agent is not None:
+                thread = threading.Thread(target=agent, args=(self.spectator,))
+                thread.daemon = True
+                thread.start()
             self.window.mainloop()
         else:
             self.start_game()
@@ -256,6 +351,10 @@ l : hold"""
         self.window.update()
 
     def start_game(self):
+        if self.mode == 'remote':
+            # the new game is shown when the server sends its state
+            self.spectator.reset()
+            return
         self.game_started = True
         if self.game_over_banner is not None:
             self.main_board.delete(self.game_over_banner)
@@ -264,10 +363,14 @@ l : hold"""
         self.first_game = False
         return self.tetris.reset()
 
-    def game_over(self):
-        self.game_over_banner = self.main_board.create_text(GUI_WIDTH/4,
-                                                GUI_HEIGHT/2,
+    def show_game_over(self):
+        width, visible = self.board_size
+        self.game_over_banner = self.main_board.create_text(width*self.board_block_unit/2,
+                                                visible*self.board_block_unit/2,
                                                 text="Game Over",
                                                 fill="white",
                                                 font="Helvetica 40 bold")
+
+    def game_over(self):
+        self.show_game_over()
         self.game_started = False
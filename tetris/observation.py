@@ -0,0 +1,158 @@
+from gym.spaces import Box
+import numpy as np
+from .tetromino import Shapes, Blocks
+
+
+# formats of observations:
+#   int8:   block values (0-7) of board and next queue
+#   packed: occupancy bits of int8 observation packed along its last axis
+#   onehot: one channel per block value (1-7) of int8 observation
+FORMATS = ('int8', 'packed', 'onehot')
+
+# block values of one-hot channels
+Values = np.arange(1, 8, dtype=np.int8)
+
+# next queue tile of every shape, which is its spawn orientation
+Tiles = [Shapes[id][0].astype(np.int8) for id in range(7)]
+OneHotTiles = [Tiles[id] == Values[:, None, None] for id in range(7)]
+
+
+def queue_tiles(width=10, visible=20, next_queue_size=5):
+    """
+    Top/left (x, y) of next queue tiles in observations that are not
+    flattened, the tiles are below the visible rows of main board in bands
+    of 4 rows with as many tiles side by side as fit in width.
+    """
+    per_band = width // 4
+    return [(4*(k % per_band), visible + 4*(k // per_band)) for k in range(next_queue_size)]
+
+
+def observation_shape(width=10, visible=20, next_queue_size=5):
+    """
+    (width, height) of int8 observations that are not flattened.
+    """
+    per_band = width // 4
+    return width, visible + 4*((next_queue_size + per_band - 1) // per_band)
+
+
+def observation_space(format='int8', flattened=False, next_queue_size=5, width=10, visible=20):
+    """
+    Observation space of a Tetris env with given observation format, width
+    and visible rows of main board.
+    """
+    # player only can see visible rows of main board, top rows are hidden
+    size = width*visible+4*4*next_queue_size
+    # main board with next queue tiles below it and padding
+    width, height = observation_shape(width, visible, next_queue_size)
+    if format == 'packed':
+        shape = ((size+7)//8,) if flattened else (1, width, (height+7)//8)
+        return Box(0, 255, shape, np.uint8)
+    if format == 'onehot':
+        shape = (7*size,) if flattened else (7, width, height)
+        return Box(0, 1, shape, np.int8)
+    if flattened:
+        return Box(0, 7, (size,), np.int8)
+    return Box(0, 7, (width, height), np.int8)
+
+
+def encode(obs, format='int8', flattened=False):
+    """
+    Encode int8 observations, obs can be one observation or a stack of them.
+    """
+    if format == 'packed':
+        return np.packbits(obs > 0, axis=-1)
+    if format == 'onehot':
+        if flattened:
+            onehot = obs[..., None, :] == Values[:, None]
+            return onehot.reshape(obs.shape[:-1]+(-1,)).view(np.int8)
+        return (obs == Values[:, None, None]).view(np.int8)
+    return obs
+
+
+class ObservationBuffer(object):
+    """
+    One preallocated observation of a Tetris env that is patched in place,
+    only blocks of the moving piece are redrawn unless main board or next
+    queue changed since last update.
+    Inputs:
+        flattened:  if use the layout of flattened observations
+        readonly:   if returns a read-only view of the buffer
+        format:     observation format, one of FORMATS
+        width:      number of columns of main board, default=10
+        visible:    number of visible rows of main board, default=20
+    """
+    def __init__(self, flattened=False, readonly=False, format='int8', width=10, visible=20):
+        self.flattened = flattened
+        self.readonly = readonly
+        self.format = format
+        self.onehot = format == 'onehot'
+        self.visible = visible
+        # the buffer has a leading channel axis, 7 one-hot channels or 1
+        channels = 7 if self.onehot else 1
+        dtype = bool if self.onehot else np.int8
+        size = width*visible
+        if flattened:
+            self.buffer = np.zeros((channels, size+4*4*5), dtype=dtype)
+            self.board = self.buffer[:, :size].reshape(channels, width, visible)
+            self.queue = [self.buffer[:, size+16*k:size+16*(k+1)].reshape(channels, 4, 4) for k in range(5)]
+        else:
+            self.buffer = np.zeros((channels,)+observation_shape(width, visible), dtype=dtype)
+            self.board = self.buffer[:, :, :visible]
+            self.queue = [self.buffer[:, x:x+4, y:y+4] for x, y in queue_tiles(width, visible)]
+        self.tiles = OneHotTiles if self.onehot else [tile[None] for tile in Tiles]
+        self.view = self.buffer.view(np.int8)
+        if flattened:
+            self.view = self.view.reshape(-1)
+        if readonly:
+            self.view = self.view.view()
+            self.view.flags.writeable = False
+        self.board_version = None
+        self.queue_version = None
+        # rows above surface are empty in the buffer
+        self.surface = visible
+        # visible blocks (channel, x, y) of the piece drawn by last update
+        self.piece_blocks = []
+
+    def update(self, env):
+        """
+        Patch the buffer with current state of env.
+        return:
+            the observation buffer, packed bits of it for packed format
+        """
+        board = self.board
+        hidden = env.hidden_rows
+        # the piece only covers empty blocks of main board
+        for c, x, y in self.piece_blocks:
+            board[c, x, y] = 0
+        if self.board_version != env.board_version:
+            # only rows below the surface of main board and of the buffer
+            # can have blocks, the ones above are empty in both
+            surface = max(min(env.column_tops) - hidden, 0)
+            top = min(surface, self.surface)
+            if self.onehot:
+                np.equal(env.main_board[:, hidden+top:], Values[:, None, None], out=board[:, :, top:])
+            else:
+                board[0, :, top:] = env.main_board[:, hidden+top:]
+            self.surface = surface
+            self.board_version = env.board_version
+        blocks = []
+        if env.piece is not None and not env.game_over:
+            px, py = env.piece.pos
+            for i, j, v in Blocks[env.piece.id][env.piece.index]:
+                if py+j >= hidden:
+                    if self.onehot:
+                        board[v-1, px+i, py+j-hidden] = 1
+                        blocks.append((v-1, px+i, py+j-hidden))
+                    else:
+                        board[0, px+i, py+j-hidden] = v
+                        blocks.append((0, px+i, py+j-hidden))
+        self.piece_blocks = blocks
+        if self.queue_version != env.queue_version:
+            for tile, id in zip(self.queue, env.next_queue):
+                tile[:] = self.tiles[id]
+            self.queue_version = env.queue_version
+        if self.format == 'packed':
+            packed = encode(self.view, 'packed')
+            packed.flags.writeable = not self.readonly
+            return packed
+        return self.view
@@ -0,0 +1,82 @@
+import importlib
+import numpy as np
+from .features import board_features
+
+
+# A policy factory is called as factory(seed) and returns the policy of the
+# episode played with that seed, a callable(env, state) returning actions.
+# Factories are module level functions so that they can be sent to worker
+# processes.
+
+
+def random_policy(seed):
+    rng = np.random.RandomState(seed)
+    def policy(env, state):
+        return rng.randint(8)
+    return policy
+
+
+def heuristic_values(boards, lines):
+    """
+    Heuristic values of boards after placements, weighs aggregate height,
+    cleared lines, holes and bumpiness.
+    """
+    f = board_features(boards)
+    return -0.51*f['aggregate_height'] + 0.76*np.asarray(lines) - 0.36*f['holes'] - 0.18*f['bumpiness']
+
+
+def heuristic_policy(seed):
+    """
+    Choose the best placement of current piece that a hard drop reaches and
+    steer the piece there with rotations and moves, then hard drop it.
+    """
+    plan = {'piece': None, 'target': None, 'last': None}
+    def policy(env, state):
+        piece = env.piece
+        if piece is None:
+            return 0
+        # plan once for every new piece
+        if plan['piece'] is not piece:
+            # placements reached by dropping the piece from the top
+            y = piece.pos[1]
+            placements = [p for p in env.get_placements() if not p.hold and
+                          env.check_move((p.pos[0], y), p.index) and
+                          p.pos[1] == y + env.drop_distance((p.pos[0], y), p.index)]
+            if not placements:
+                return 4
+            values = heuristic_values([p.board for p in placements], [p.lines for p in placements])
+            best = placements[int(np.argmax(values))]
+            plan['piece'] = piece
+            plan['target'] = (best.index, best.pos[0])
+            plan['last'] = None
+        index, x = plan['target']
+        now = (piece.index, piece.pos[0])
+        # the piece is blocked, drop it where it is
+        if now == plan['last']:
+            return 4
+        plan['last'] = now
+        if piece.index != index:
+            return 6
+        if piece.pos[0] > x:
+            return 1
+        if piece.pos[0] < x:
+            return 2
+        return 4
+    return policy
+
+
+POLICIES = {
+    'random': random_policy,
+    'heuristic': heuristic_policy,
+}
+
+
+def load_policy(name):
+    """
+    Policy factory of a name of POLICIES or of module:function.
+    """
+    if name in POLICIES:
+        return POLICIES[name]
+    assert ':' in name, 'unknown policy: %s' % name
+    module, function = name.split(':')
+    return getattr(importlib.import_module(module), function)
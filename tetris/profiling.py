@@ -0,0 +1,239 @@
+import bisect
+import json
+import os
+import time
+
+
+# upper bounds of latency buckets in seconds, from 1us to 10ms
+LATENCY_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 1e-2)
+# upper bounds of buckets of collision checks per step
+CHECK_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+# upper bounds of buckets of lines cleared per episode
+LINE_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# phases of a step and the Tetris methods they time, nested phases are also
+# counted in the ones calling them, land includes clear and spawn:
+#   step:           play_action and play_placement, one step without building
+#                   its observation
+#   check:          check_move, move validation of both backends
+#   land:           land_piece
+#   clear:          clear_lines
+#   spawn:          spawn_piece
+#   observation:    get_observation
+PHASES = (
+    ('step', 'play_action'),
+    ('step', 'play_placement'),
+    ('check', 'check_move'),
+    ('land', 'land_piece'),
+    ('clear', 'clear_lines'),
+    ('spawn', 'spawn_piece'),
+    ('observation', 'get_observation'),
+)
+
+
+class Histogram(object):
+    """
+    Counts of observed values in buckets of upper bounds, like Prometheus
+    histograms the last bucket is +Inf.
+    Inputs:
+        bounds:     ascending upper bounds of buckets
+    """
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        return {'bounds': list(self.bounds), 'counts': list(self.counts),
+                'sum': self.sum, 'count': self.count}
+
+
+class Profiler(object):
+    """
+    Counters and latency histograms of the phases of Tetris steps. It is
+    attached to envs by attach(env), which replaces the timed methods of that
+    env with timing wrappers, so envs without a profiler run no extra code.
+    One profiler can be attached to many envs to aggregate them.
+    Inputs:
+        labels:     dict of labels added to every exported metric, such as
+                    the host or the agent, default=None
+    Important Members:
+        phases:     Histogram of latencies in seconds of every phase, see
+                    PHASES
+        checks:     Histogram of collision checks made by steps, the ones of
+                    action masks and placement searches between steps are
+                    not counted
+        lines:      Histogram of lines cleared per episode
+        steps, episodes, total_lines:   counters
+    """
+    def __init__(self, labels=None):
+        self.labels = dict(labels or {})
+        self.reset()
+
+    def reset(self):
+        self.phases = {}
+        for phase, _ in PHASES:
+            self.phases[phase] = Histogram(LATENCY_BUCKETS)
+        self.checks = Histogram(CHECK_BUCKETS)
+        self.lines = Histogram(LINE_BUCKETS)
+        self.steps = 0
+        self.episodes = 0
+        self.total_lines = 0
+        # collision checks of the current step
+        self.step_checks = 0
+
+    def attach(self, env):
+        """
+        Time the phases of env from now on, env.profiler is set to self.
+        """
+        if getattr(env, 'profiler', None) is not None:
+            env.profiler.detach(env)
+        for phase, name in PHASES:
+            method = getattr(env, name)
+            if name == 'check_move':
+                wrapper = self.timed_check(method)
+            elif name in ('play_action', 'play_placement'):
+                wrapper = self.timed_step(env, method)
+            else:
+                wrapper = self.timed(self.phases[phase], method)
+            setattr(env, name, wrapper)
+        env.reset = self.timed_reset(env, env.reset)
+        env.profiler = self
+        # an episode is counted once when it is over
+        env.profiled_episode = env.game_over
+
+    def detach(self, env):
+        for _, name in PHASES + (('reset', 'reset'),):
+            env.__dict__.pop(name, None)
+        env.profiler = None
+
+    def timed(self, histogram, method):
+        timer = time.perf_counter
+        def wrapper(*args, **kwargs):
+            start = timer()
+            result = method(*args, **kwargs)
+            histogram.observe(timer() - start)
+            return result
+        return wrapper
+
+    def timed_check(self, method):
+        timer = time.perf_counter
+        histogram = self.phases['check']
+        def wrapper(*args, **kwargs):
+            start = timer()
+            result = method(*args, **kwargs)
+            histogram.observe(timer() - start)
+            self.step_checks += 1
+            return result
+        return wrapper
+
+    def timed_step(self, env, method):
+        timer = time.perf_counter
+        histogram = self.phases['step']
+        def wrapper(*args, **kwargs):
+            # checks made between steps don't belong to this one
+            self.step_checks = 0
+            start = timer()
+            result = method(*args, **kwargs)
+            histogram.observe(timer() - start)
+            self.steps += 1
+            self.checks.observe(self.step_checks)
+            if env.game_over and not env.profiled_episode:
+                self.end_episode(env)
+            return result
+        return wrapper
+
+    def timed_reset(self, env, method):
+        def wrapper(*args, **kwargs):
+            # episodes reset before game over are counted as they are
+            if env.t > 0 and not env.profiled_episode:
+                self.end_episode(env)
+            result = method(*args, **kwargs)
+            env.profiled_episode = False
+            return result
+        return wrapper
+
+    def end_episode(self, env):
+        self.episodes += 1
+        self.total_lines += env.lines
+        self.lines.observe(env.lines)
+        env.profiled_episode = True
+
+    def snapshot(self):
+        """
+        return:
+            dict of all metrics that can be dumped as JSON
+        """
+        return {
+            'labels': dict(self.labels),
+            'steps': self.steps,
+            'episodes': self.episodes,
+            'lines': self.total_lines,
+            'phase_seconds': {phase: h.snapshot() for phase, h in self.phases.items()},
+            'collision_checks_per_step': self.checks.snapshot(),
+            'lines_per_episode': self.lines.snapshot(),
+        }
+
+    def prometheus(self):
+        """
+        return:
+            metrics in Prometheus text exposition format
+        """
+        out = []
+        for name, value, help in (
+                ('tetris_steps_total', self.steps, 'Steps played.'),
+                ('tetris_episodes_total', self.episodes, 'Episodes played.'),
+                ('tetris_lines_total', self.total_lines, 'Lines cleared.')):
+            out.append('# HELP %s %s' % (name, help))
+            out.append('# TYPE %s counter' % name)
+            out.append('%s%s %d' % (name, format_labels(self.labels), value))
+        name = 'tetris_phase_seconds'
+        out.append('# HELP %s Latency of phases of steps.' % name)
+        out.append('# TYPE %s histogram' % name)
+        for phase, histogram in self.phases.items():
+            out.extend(format_histogram(name, histogram, dict(self.labels, phase=phase)))
+        for name, histogram, help in (
+                ('tetris_collision_checks_per_step', self.checks, 'Collision checks of a step.'),
+                ('tetris_lines_per_episode', self.lines, 'Lines cleared in an episode.')):
+            out.append('# HELP %s %s' % (name, help))
+            out.append('# TYPE %s histogram' % name)
+            out.extend(format_histogram(name, histogram, self.labels))
+        return '\n'.join(out) + '\n'
+
+    def write(self, path):
+        """
+        Write metrics to path, in Prometheus text format (for node exporter
+        textfile collectors) unless path ends with .json. The file is
+        replaced at once, readers never see a partial one.
+        """
+        if path.endswith('.json'):
+            text = json.dumps(self.snapshot(), indent=2)
+        else:
+            text = self.prometheus()
+        with open(path + '.tmp', 'w') as f:
+            f.write(text)
+        os.rename(path + '.tmp', path)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, value in labels.items())
+
+
+def format_histogram(name, histogram, labels):
+    out = []
+    total = 0
+    for bound, count in zip(histogram.bounds + ('+Inf',), histogram.counts):
+        total += count
+        out.append('%s_bucket%s %d' % (name, format_labels(dict(labels, le=bound)), total))
+    out.append('%s_sum%s %r' % (name, format_labels(labels), float(histogram.sum)))
+    out.append('%s_count%s %d' % (name, format_labels(labels), histogram.count))
+    return out
@@ -0,0 +1,57 @@
+import numpy as np
+
+
+MODES = ('uniform', 'bag')
+
+
+class Randomizer(object):
+    """
+    Seeded sequence of shape ids, ids are generated in blocks so that
+    drawing one is a list lookup. Block k is generated from (seed, k) only,
+    thus a position of the sequence is saved as (seed, block, offset).
+    Inputs:
+        seed:       seed of the sequence, None to seed from system entropy
+        mode:       'uniform' draws every id independently, 'bag' draws
+                    permutations of all 7 shapes (7-bag randomizer)
+        block_size: number of ids generated at once, multiple of 7
+    """
+    def __init__(self, seed=None, mode='uniform', block_size=7*128):
+        assert mode in MODES, 'unknown randomizer mode: %s' % mode
+        assert block_size % 7 == 0, 'block size must be a multiple of 7'
+        if seed is None:
+            seed = np.random.RandomState().randint(2**31)
+        self.seed = seed
+        self.mode = mode
+        self.block_size = block_size
+        self.block = 0
+        self.offset = 0
+        # the block that ids are generated for, blocks are generated lazily
+        self.loaded = None
+        self.ids = []
+
+    def load(self):
+        rng = np.random.RandomState([self.seed, self.block])
+        if self.mode == 'bag':
+            self.ids = np.argsort(rng.rand(self.block_size//7, 7), axis=1).ravel().tolist()
+        else:
+            self.ids = rng.randint(7, size=self.block_size).tolist()
+        self.loaded = (self.seed, self.block)
+
+    def next(self):
+        """
+        Draw next shape id.
+        """
+        if self.offset == self.block_size:
+            self.block += 1
+            self.offset = 0
+        if self.loaded != (self.seed, self.block):
+            self.load()
+        id = self.ids[self.offset]
+        self.offset += 1
+        return id
+
+    def get_state(self):
+        return (self.seed, self.block, self.offset)
+
+    def set_state(self, state):
+        self.seed, self.block, self.offset = state
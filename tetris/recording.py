@@ -0,0 +1,341 @@
+import os
+from collections import namedtuple
+import numpy as np
+from .game import Tetris, GameState
+
+
+# A shard is a pair of append-only files, path holds episode records and
+# path.idx one INDEX entry per episode, both start with MAGIC. An episode
+# record is a HEADER, its actions, optionally its rewards and its keyframes,
+# every part padded to 8 bytes.
+MAGIC = b'TETREP\x00\x03'
+
+# flags of episodes
+REWARDS = 1
+BAG = 2
+
+HEADER = np.dtype([('steps', '<u4'), ('flags', '<u4'), ('horizon', '<i4'), ('keyframes', '<u4'),
+                   ('width', '<u2'), ('height', '<u2'), ('hidden_rows', '<u2'), ('reserved', '<u2'),
+                   ('seed', '<i8'), ('block', '<i8'), ('offset', '<i8'), ('score', '<i8')])
+INDEX = np.dtype([('offset', '<u8'), ('size', '<u8'), ('steps', '<u4'), ('flags', '<u4'),
+                  ('score', '<i8')])
+
+# recorded action of Tetris.step_placement(i) is PLACEMENT+i, invalid actions
+# of Tetris.step are recorded as noop
+PLACEMENT = 8
+
+# An episode read from a shard, actions, rewards and keyframes are views of
+# the memory-mapped file
+Episode = namedtuple('Episode', ['seed', 'block', 'offset', 'randomizer', 'horizon', 'width',
+                                 'height', 'hidden_rows', 'score', 'actions', 'rewards',
+                                 'keyframes'])
+
+
+def keyframe_dtype(width, height):
+    """
+    Keyframes of episodes on width x height boards, a GameState after the
+    first step steps of an episode, None is -1.
+    """
+    return np.dtype([('step', '<u4'), ('t', '<i4'), ('score', '<i8'), ('lines', '<i8'),
+                     ('seed', '<i8'), ('block', '<i8'), ('offset', '<i8'),
+                     ('board', 'i1', (width, height)), ('column_tops', '<u2', width),
+                     ('piece', '<i2', 4), ('held', 'i1'), ('next_queue', 'i1', 5),
+                     ('swapped', 'u1'), ('game_over', 'u1')])
+
+
+def padded(size):
+    return (size + 7) // 8 * 8
+
+
+def pack_keyframe(step, state, dtype):
+    keyframe = np.zeros(1, dtype=dtype)[0]
+    keyframe['step'] = step
+    keyframe['t'] = state.t
+    keyframe['score'] = state.score
+    keyframe['lines'] = state.lines
+    keyframe['seed'], keyframe['block'], keyframe['offset'] = state.rng
+    keyframe['board'] = np.frombuffer(state.board, dtype=np.int8).reshape(keyframe['board'].shape)
+    keyframe['column_tops'] = state.column_tops
+    keyframe['piece'] = state.piece if state.piece is not None else (-1, -1, -1, -1)
+    keyframe['held'] = state.held if state.held is not None else -1
+    keyframe['next_queue'] = state.next_queue
+    keyframe['swapped'] = state.swapped
+    keyframe['game_over'] = state.game_over
+    return keyframe
+
+
+def unpack_keyframe(keyframe):
+    piece = tuple(int(v) for v in keyframe['piece'])
+    held = int(keyframe['held'])
+    return GameState(
+        keyframe['board'].tobytes(),
+        None,
+        tuple(int(v) for v in keyframe['column_tops']),
+        piece if piece[0] >= 0 else None,
+        held if held >= 0 else None,
+        tuple(int(v) for v in keyframe['next_queue']),
+        bool(keyframe['swapped']),
+        int(keyframe['score']),
+        int(keyframe['lines']),
+        int(keyframe['t']),
+        bool(keyframe['game_over']),
+        (int(keyframe['seed']), int(keyframe['block']), int(keyframe['offset'])))
+
+
+def open_shard(path):
+    """
+    Open path and path.idx for appending, with MAGIC written to new files.
+    """
+    files = []
+    for name in (path, path + '.idx'):
+        f = open(name, 'ab')
+        if f.tell() == 0:
+            f.write(MAGIC)
+        files.append(f)
+    return files
+
+
+class Recorder(object):
+    """
+    Record episodes of a Tetris env into a shard as the piece sequence
+    state at reset plus the actions, which replay the episode exactly.
+    Episodes are recorded from reset to game over, an episode is written
+    when it is over, the env is reset or the recorder is closed. It is
+    attached by assigning it to env.recorder.
+    Inputs:
+        path:               file of episode records, the index is path.idx,
+                            episodes are appended to existing files
+        rewards:            if record the reward of every step, default=False
+        keyframe_interval:  save the game state every keyframe_interval
+                            steps so that replays can start from there,
+                            0 means never, default=256
+    """
+    def __init__(self, path, rewards=False, keyframe_interval=256):
+        assert 0 <= keyframe_interval, 'keyframe interval must not be negative'
+        self.path = path
+        self.rewards = rewards
+        self.keyframe_interval = keyframe_interval
+        self.data, self.index = open_shard(path)
+        self.offset = self.data.tell()
+        self.episodes = 0
+        # the episode being recorded, None between episodes
+        self.header = None
+        self.actions = []
+        self.step_rewards = []
+        self.keyframes = []
+        self.keyframe_dtype = None
+        self.score = 0
+
+    def record_reset(self, env, rng):
+        """
+        Start an episode of env that was just reset, rng is the randomizer
+        state before the reset.
+        """
+        self.end_episode()
+        self.header = np.zeros(1, dtype=HEADER)[0]
+        self.header['flags'] = (REWARDS if self.rewards else 0) | (BAG if env.randomizer.mode == 'bag' else 0)
+        self.header['horizon'] = env.horizon
+        self.header['width'] = env.width
+        self.header['height'] = env.height
+        self.header['hidden_rows'] = env.hidden_rows
+        if self.keyframe_dtype is None or self.keyframe_dtype['board'].shape != (env.width, env.height):
+            self.keyframe_dtype = keyframe_dtype(env.width, env.height)
+        self.header['seed'], self.header['block'], self.header['offset'] = rng
+        self.actions = []
+        self.step_rewards = []
+        self.keyframes = []
+        self.score = 0
+
+    def record_step(self, env, action, reward):
+        # invalid actions do nothing like noop
+        if not 0 <= action < PLACEMENT:
+            action = 0
+        self.append(env, action, reward)
+
+    def check_placement(self, i):
+        """
+        Raise ValueError if placement i can't be recorded in one byte, it is
+        called before the placement is played so the env is left unchanged.
+        """
+        if not 0 <= i < 256 - PLACEMENT:
+            raise ValueError('placement %d can not be recorded' % i)
+
+    def record_placement(self, env, i, reward):
+        self.append(env, PLACEMENT + i, reward)
+
+    def append(self, env, action, reward):
+        if self.header is None:
+            return
+        self.actions.append(action)
+        if self.rewards:
+            self.step_rewards.append(reward)
+        self.score = env.score
+        steps = len(self.actions)
+        if env.game_over:
+            self.end_episode()
+        elif self.keyframe_interval and steps % self.keyframe_interval == 0:
+            self.keyframes.append(pack_keyframe(steps, env.clone_state(), self.keyframe_dtype))
+
+    def end_episode(self):
+        """
+        Write the episode being recorded, unfinished ones are written as
+        they are.
+        """
+        header = self.header
+        if header is None:
+            return
+        score = self.score
+        header['steps'] = len(self.actions)
+        header['keyframes'] = len(self.keyframes)
+        header['score'] = score
+        parts = [header.tobytes(), np.array(self.actions, dtype=np.uint8).tobytes()]
+        if self.rewards:
+            parts.append(np.array(self.step_rewards, dtype='<i4').tobytes())
+        parts.append(np.array(self.keyframes, dtype=self.keyframe_dtype).tobytes())
+        size = 0
+        for part in parts:
+            self.data.write(part + b'\0' * (padded(len(part)) - len(part)))
+            size += padded(len(part))
+        self.data.flush()
+        # the index entry is written last, readers only see complete records
+        entry = np.array([(self.offset, size, header['steps'], header['flags'], score)], dtype=INDEX)
+        self.index.write(entry.tobytes())
+        self.index.flush()
+        self.offset += size
+        self.episodes += 1
+        self.header = None
+
+    def close(self):
+        self.end_episode()
+        self.data.close()
+        self.index.close()
+
+
+class EpisodeReader(object):
+    """
+    Read episodes of shards written by Recorder, files are memory-mapped
+    and episodes are replayed by Tetris envs on demand.
+    Inputs:
+        paths:  path of a shard or a list of them
+    Important Members:
+        index:  INDEX entries of all episodes of all shards
+        shards: shard number of every episode
+    """
+    def __init__(self, paths):
+        if isinstance(paths, str):
+            paths = [paths]
+        self.paths = list(paths)
+        self.data = []
+        indices = []
+        for shard, path in enumerate(self.paths):
+            for name in (path, path + '.idx'):
+                with open(name, 'rb') as f:
+                    assert f.read(len(MAGIC)) == MAGIC, 'not an episode shard: %s' % name
+            if os.path.getsize(path + '.idx') > len(MAGIC):
+                entries = np.memmap(path + '.idx', dtype=INDEX, mode='r', offset=len(MAGIC))
+                self.data.append(np.memmap(path, dtype=np.uint8, mode='r'))
+            else:
+                entries = np.zeros(0, dtype=INDEX)
+                self.data.append(None)
+            indices.append(entries)
+        self.shards = np.repeat(np.arange(len(self.paths)), [len(entries) for entries in indices])
+        self.index = np.concatenate(indices) if indices else np.zeros(0, dtype=INDEX)
+
+    def __len__(self):
+        return len(self.index)
+
+    def episode(self, k):
+        entry = self.index[k]
+        data = self.data[self.shards[k]]
+        offset = int(entry['offset'])
+        header = data[offset:offset+HEADER.itemsize].view(HEADER)[0]
+        steps = int(header['steps'])
+        offset += padded(HEADER.itemsize)
+        actions = data[offset:offset+steps]
+        offset += padded(steps)
+        rewards = None
+        if header['flags'] & REWARDS:
+            rewards = data[offset:offset+4*steps].view('<i4')
+            offset += padded(4*steps)
+        width, height = int(header['width']), int(header['height'])
+        dtype = keyframe_dtype(width, height)
+        keyframes = data[offset:offset+dtype.itemsize*int(header['keyframes'])].view(dtype)
+        return Episode(int(header['seed']), int(header['block']), int(header['offset']),
+                       'bag' if header['flags'] & BAG else 'uniform', int(header['horizon']),
+                       width, height, int(header['hidden_rows']), int(header['score']),
+                       actions, rewards, keyframes)
+
+    def make_env(self, k, **env_kwargs):
+        """
+        Tetris env at the start of episode k, env_kwargs are passed to Tetris
+        except horizon, randomizer and board sizes which are the recorded
+        ones.
+        """
+        ep = self.episode(k)
+        env = Tetris(horizon=ep.horizon, seed=ep.seed, randomizer=ep.randomizer, width=ep.width,
+                     height=ep.height, hidden_rows=ep.hidden_rows, **env_kwargs)
+        env.randomizer.set_state((ep.seed, ep.block, ep.offset))
+        env.reset()
+        return env
+
+    def seek(self, k, step, **env_kwargs):
+        """
+        Tetris env after the first step steps of episode k, it starts from
+        the last keyframe before it.
+        """
+        ep = self.episode(k)
+        assert 0 <= step <= len(ep.actions), 'step out of episode'
+        env = self.make_env(k, **env_kwargs)
+        start = 0
+        i = np.searchsorted(ep.keyframes['step'], step, side='right') - 1
+        if i >= 0:
+            start = int(ep.keyframes[i]['step'])
+            env.restore_state(unpack_keyframe(ep.keyframes[i]))
+        for action in ep.actions[start:step]:
+            play(env, action)
+        return env
+
+    def replay(self, k, start=0, **env_kwargs):
+        """
+        Replay episode k from step start.
+        return:
+            generator of (state, action, reward, done), and info if
+            return_info is in env_kwargs, state is the observation before
+            action
+        """
+        ep = self.episode(k)
+        env = self.seek(k, start, **env_kwargs)
+        state = env.get_observation()
+        for action in ep.actions[start:]:
+            result = play(env, action)
+            yield (state, int(action)) + tuple(result[1:])
+            state = result[0]
+        assert not ep.actions.size or not env.game_over or env.score == ep.score, \
+            'replay of episode %d diverged' % k
+
+    def observations(self, k, start=0, stop=None, **env_kwargs):
+        """
+        Observations before actions start to stop of episode k stacked in
+        one array.
+        """
+        ep = self.episode(k)
+        stop = len(ep.actions) if stop is None else stop
+        env = self.seek(k, start, **env_kwargs)
+        states = []
+        state = env.get_observation()
+        for action in ep.actions[start:stop]:
+            states.append(state.copy())
+            state = play(env, action)[0]
+        if not states:
+            # observation_space has no channel axis for 2d int8 observations
+            return np.zeros((0,)+state.shape, dtype=state.dtype)
+        return np.stack(states)
+
+
+def play(env, action):
+    """
+    Apply a recorded action to env.
+    """
+    if action >= PLACEMENT:
+        return env.step_placement(int(action) - PLACEMENT)
+    return env.step(int(action))
@@ -0,0 +1,118 @@
+import numpy as np
+from .colors import BLACK, GRAY, WHITE, COLORS
+from .tetromino import Blocks
+from .observation import Tiles
+
+
+def hex_to_rgb(color):
+    return [int(color[k:k+2], 16) for k in (1, 3, 5)]
+
+
+# cell codes of the frame layout, block values 0-7 are COLORS
+FRAME = 8
+TEXT = 9
+CODES = COLORS + [GRAY, WHITE]
+# colors of cell codes, followed by colors of their borders which separate
+# blocks from each other like the GUI does
+PALETTE = np.array([hex_to_rgb(c) for c in CODES] +
+                   [hex_to_rgb(c) for c in [BLACK]*8 + [GRAY, WHITE]], dtype=np.uint8)
+
+# 3x5 glyphs of score digits
+DIGITS = ["111101101101111", "010110010010111", "111001111100111", "111001111001111",
+          "101101111001001", "111100111001111", "111100111101111", "111001001001001",
+          "111101111101111", "111101111001111"]
+Glyphs = [np.array([int(c) for c in g], dtype=bool).reshape(5, 3) for g in DIGITS]
+
+def frame_layout(width=10, visible=20):
+    """
+    Layout of frames of a board with width columns and visible rows, in
+    blocks with x to the right and y downwards: board at the left, two
+    columns of 4x4 tiles right of it and a score band of 3 rows at the bottom.
+    return:
+        frame width, frame height, (x, y) of the held piece tile and of the
+        next queue tiles in spawn order
+    """
+    left, right = width+1, width+6
+    tiles = [(left, 1), (right, 1), (left, 6), (right, 6), (left, 11), (right, 11)]
+    return width+11, max(visible, 15)+3, tiles[0], tiles[1:]
+
+
+class RGBRenderer(object):
+    """
+    Rasterize a Tetris game into an RGB image with numpy, blocks are drawn
+    as cell codes in a small grid that is upscaled and mapped through a
+    palette, it doesn't need a display.
+    Inputs:
+        block_size: side length of a block in pixels, default=8
+    """
+    def __init__(self, block_size=8):
+        assert block_size >= 2, 'block size must be at least 2 pixels'
+        self.block_size = block_size
+        # (width, visible rows) of boards and the frame layout built for them
+        self.size = None
+        # digits are 3x5 glyphs scaled to fit 10 of them in the score band
+        self.scale = max(1, 2*block_size//5)
+        self.glyphs = [np.kron(g, np.ones((self.scale, self.scale), dtype=bool)) for g in Glyphs]
+        # score that text is the rasterized digits of
+        self.text_score = None
+        self.text = None
+
+    def render(self, env):
+        """
+        return:
+            (H, W, 3) uint8 image of main board with current piece, held
+            piece, next queue and score of env
+        """
+        hidden = env.hidden_rows
+        width, height = env.main_board.shape
+        if self.size != (width, height-hidden):
+            self.layout(width, height-hidden)
+        codes = self.template.copy()
+        board = codes[0:width, 0:height-hidden]
+        board[:] = env.main_board[:, hidden:]
+        if env.piece is not None and not env.game_over:
+            px, py = env.piece.pos
+            for i, j, v in Blocks[env.piece.id][env.piece.index]:
+                if py+j >= hidden:
+                    board[px+i, py+j-hidden] = v
+        if env.held_piece is not None:
+            x, y = self.hold_tile
+            codes[x:x+4, y:y+4] = Tiles[env.held_piece.id]
+        for (x, y), id in zip(self.queue_tiles, env.next_queue[::-1]):
+            codes[x:x+4, y:y+4] = Tiles[id]
+        b = self.block_size
+        pixels = np.repeat(np.repeat(codes.T, b, axis=0), b, axis=1)
+        pixels += self.border
+        image = PALETTE.take(pixels, axis=0)
+        self.draw_score(image, env.score)
+        return image
+
+    def layout(self, width, visible):
+        frame_width, frame_height, self.hold_tile, self.queue_tiles = frame_layout(width, visible)
+        # background of the grid, indexed (x, y) like main board
+        self.template = np.full((frame_width, frame_height), FRAME, dtype=np.int8)
+        self.template[0:width, 0:visible] = 0
+        for x, y in [self.hold_tile] + self.queue_tiles:
+            self.template[x:x+4, y:y+4] = 0
+        self.template[:, -3:] = 0
+        # last row and column of pixels of every block is its border
+        b = self.block_size
+        border = np.zeros((b, b), dtype=np.int8)
+        border[-1, :] = len(CODES)
+        border[:, -1] = len(CODES)
+        self.border = np.tile(border, (frame_height, frame_width))
+        self.size = (width, visible)
+
+    def draw_score(self, image, score):
+        if score != self.text_score:
+            s = self.scale
+            self.text = np.hstack([np.pad(self.glyphs[int(c)], ((0, 0), (0, s)), 'constant')
+                                   for c in "{:010d}".format(score)])
+            self.text_score = score
+        text = self.text
+        # centered in the score band, clipped if the score is too long
+        height, width = text.shape
+        width = min(width, image.shape[1])
+        top = image.shape[0] - 3*self.block_size + (3*self.block_size-height)//2
+        left = (image.shape[1]-width)//2
+        image[top:top+height, left:left+width][text[:, :width]] = PALETTE[TEXT]
@@ -0,0 +1,542 @@
+import argparse
+import asyncio
+import socket
+import struct
+import threading
+from collections import deque, OrderedDict
+import numpy as np
+from .game import Tetris, GameState
+
+# Frames of the protocol are a HEADER of frame type, session id and payload
+# size followed by the payload, all little endian.
+HEADER = struct.Struct('<BII')
+
+# client to server frames
+OPEN = 1        # payload OPEN_ARGS, the server answers OPENED with the new id
+ACTION = 2      # payload one action byte per action, applied in order
+RESET = 3       # no payload, queued after pending actions
+CLOSE = 4       # no payload
+WATCH = 5       # no payload, receive frames of a session of another client
+# server to client frames
+OPENED = 16     # no payload
+STATE = 17      # payload STATE_ARGS
+BOARD = 18      # payload BOARD_SIZE and main board bytes, sent before STATE
+                # when main board changed
+ERROR = 19      # payload utf-8 message
+
+# horizon, seed (-1 seeds from system entropy), width, height, hidden rows,
+# randomizer (0 uniform, 1 bag), gravity interval in ms (0 means no gravity)
+OPEN_ARGS = struct.Struct('<iqHHBBH')
+# t, score, lines, current piece id (-1 if none), index, x, y, held piece id (-1 if
+# none), flags, next queue shape ids with the last one spawned first
+STATE_ARGS = struct.Struct('<IqIbbhhbb5b')
+BOARD_SIZE = struct.Struct('<HH')
+# flags of STATE
+GAME_OVER = 1
+SWAPPED = 2
+
+RANDOMIZERS = ('uniform', 'bag')
+# input queued by RESET
+RESET_INPUT = -1
+
+
+def pack_frame(type, session, payload=b''):
+    return HEADER.pack(type, session, len(payload)) + payload
+
+
+def pack_state(env):
+    piece = env.piece
+    if piece is not None:
+        id, index, (x, y) = piece.id, piece.index, piece.pos
+    else:
+        id, index, x, y = -1, 0, 0, 0
+    held = env.held_piece.id if env.held_piece is not None else -1
+    flags = (GAME_OVER if env.game_over else 0) | (SWAPPED if env.swapped else 0)
+    return STATE_ARGS.pack(env.t, env.score, env.lines, id, index, x, y, held, flags, *env.next_queue)
+
+
+def pack_board(env):
+    return BOARD_SIZE.pack(env.width, env.height) + env.main_board.tobytes()
+
+
+class Session(object):
+    """
+    A game hosted by the server.
+    Important Members:
+        inputs:     deque of actions and resets to apply on next ticks
+        watchers:   connections that receive frames of this game, its owner
+                    and the ones that watch it
+    """
+    def __init__(self, id, env, owner, gravity):
+        self.id = id
+        self.env = env
+        self.owner = owner
+        self.gravity = gravity
+        self.inputs = deque()
+        self.watchers = set([owner]) if owner is not None else set()
+        # board version that watchers have seen
+        self.sent_board = None
+
+
+class Connection(object):
+    """
+    A client connection, frames for it are collected during a tick and
+    written at once.
+    """
+    def __init__(self, writer):
+        self.writer = writer
+        self.out = bytearray()
+        self.sessions = set()
+        self.closed = False
+
+    def send(self, frame):
+        self.out += frame
+
+    def flush(self, max_buffer):
+        if self.closed or not self.out:
+            return
+        self.writer.write(bytes(self.out))
+        self.out = bytearray()
+        # a client that doesn't read would delay everyone, drop it
+        if self.writer.transport.get_write_buffer_size() > max_buffer:
+            self.closed = True
+            self.writer.close()
+
+
+class GameServer(object):
+    """
+    Host many Tetris games in one process for clients of a TCP or Unix
+    socket. One tick scheduler applies queued inputs of all games, drops
+    pieces by gravity and sends the new states, so the work of a tick is
+    bounded by the number of games that changed.
+    Inputs:
+        tick_rate:      ticks per second, default=60
+        max_actions:    max number of inputs of a game applied per tick, the
+                        rest wait for next ticks, default=4
+        tick_budget:    max number of inputs of all games applied per tick,
+                        games are served in turn and the ones left over go
+                        first next tick, default=2048
+        max_pending:    max number of queued inputs of a game, more are
+                        dropped, default=64
+        max_sessions:   max number of games, default=10000
+        max_width, max_height: max size of main boards of games, larger
+                        ones are refused, default=64x128
+        max_buffer:     max bytes waiting to be sent to a client, slower
+                        clients are disconnected, default=4MB
+        env_kwargs:     arguments passed to every Tetris env
+    Important Members:
+        ticks:      number of ticks run
+        overruns:   number of ticks that took longer than the tick interval
+        tick_time:  max duration of a tick in seconds
+    """
+    def __init__(self, tick_rate=60, max_actions=4, tick_budget=2048, max_pending=64,
+                 max_sessions=10000, max_buffer=4*2**20, max_width=64, max_height=128, **env_kwargs):
+        assert tick_rate > 0, 'tick rate must be positive'
+        assert 1 <= max_actions <= tick_budget, 'max_actions must be positive and within tick_budget'
+        self.tick_rate = tick_rate
+        self.max_actions = max_actions
+        self.tick_budget = tick_budget
+        self.max_pending = max_pending
+        self.max_sessions = max_sessions
+        self.max_buffer = max_buffer
+        self.max_width = max_width
+        self.max_height = max_height
+        self.env_kwargs = dict({'backend': 'bitboard'}, **env_kwargs)
+        self.sessions = {}
+        self.next_id = 1
+        # sessions with queued inputs in the order they are served
+        self.pending = OrderedDict()
+        # gravity wheels by interval in ticks, sessions in slot k fall on
+        # ticks t with t % interval == k
+        self.wheels = {}
+        self.connections = set()
+        self.ticks = 0
+        self.overruns = 0
+        self.tick_time = 0.0
+        self.running = False
+
+    def open_session(self, owner, horizon=-1, seed=None, width=10, height=22, hidden_rows=2,
+                     randomizer='uniform', gravity=0):
+        """
+        Start a game owned by a connection, gravity is the interval in ms of
+        automatic move downs, 0 means none.
+        return:
+            Session
+        """
+        # sizes come from clients, they are checked even when asserts are off
+        if len(self.sessions) >= self.max_sessions:
+            raise ValueError('too many sessions')
+        # boards are built on the event loop, large ones would stall all games
+        if width > self.max_width or height > self.max_height:
+            raise ValueError('board is larger than %dx%d' % (self.max_width, self.max_height))
+        if width < 4 or height < 4:
+            raise ValueError('main board must be at least 4x4')
+        if not 0 <= hidden_rows < height:
+            raise ValueError('hidden rows must leave visible rows')
+        env = Tetris(horizon=horizon, seed=seed, randomizer=randomizer, width=width,
+                     height=height, hidden_rows=hidden_rows, **self.env_kwargs)
+        env.reset()
+        ticks = int(round(gravity * self.tick_rate / 1000.0))
+        session = Session(self.next_id, env, owner, max(ticks, 1) if gravity > 0 else 0)
+        self.next_id += 1
+        self.sessions[session.id] = session
+        if session.gravity:
+            wheel = self.wheels.setdefault(session.gravity, [set() for _ in range(session.gravity)])
+            wheel[self.ticks % session.gravity].add(session)
+        if owner is not None:
+            owner.sessions.add(session)
+        return session
+
+    def close_session(self, session):
+        self.sessions.pop(session.id, None)
+        self.pending.pop(session, None)
+        if session.gravity:
+            for slot in self.wheels[session.gravity]:
+                slot.discard(session)
+        for conn in session.watchers:
+            conn.sessions.discard(session)
+        session.watchers = set()
+
+    def queue(self, session, inputs):
+        room = self.max_pending - len(session.inputs)
+        session.inputs.extend(inputs[:max(room, 0)])
+        if session.inputs and session not in self.pending:
+            self.pending[session] = None
+
+    def tick(self):
+        """
+        Apply up to max_actions queued inputs of games within tick_budget,
+        then gravity of the games due this tick, and send the states of
+        changed games.
+        """
+        changed = set()
+        budget = self.tick_budget
+        max_actions = self.max_actions
+        pending = self.pending
+        for session in list(pending):
+            if budget < max_actions:
+                break
+            env = session.env
+            inputs = session.inputs
+            num = min(max_actions, len(inputs))
+            for _ in range(num):
+                action = inputs.popleft()
+                if action == RESET_INPUT:
+                    env.reset()
+                else:
+                    env.play_action(action)
+            budget -= num
+            changed.add(session)
+            # games with inputs left wait behind the others
+            del pending[session]
+            if inputs:
+                pending[session] = None
+        for interval, wheel in self.wheels.items():
+            for session in wheel[self.ticks % interval]:
+                if not session.env.game_over:
+                    session.env.play_action(3)
+                    changed.add(session)
+        self.ticks += 1
+        for session in changed:
+            self.publish(session)
+        for conn in self.connections:
+            conn.flush(self.max_buffer)
+
+    def publish(self, session, force_board=False):
+        if not session.watchers:
+            return
+        env = session.env
+        frames = b''
+        if force_board or session.sent_board != env.board_version:
+            frames = pack_frame(BOARD, session.id, pack_board(env))
+            session.sent_board = env.board_version
+        frames += pack_frame(STATE, session.id, pack_state(env))
+        for conn in session.watchers:
+            conn.send(frames)
+
+    def handle(self, conn, type, id, payload):
+        """
+        Process a frame received from a client.
+        """
+        if type == OPEN:
+            horizon, seed, width, height, hidden_rows, randomizer, gravity = OPEN_ARGS.unpack(payload)
+            session = self.open_session(conn, horizon, None if seed < 0 else seed, width, height,
+                                        hidden_rows, RANDOMIZERS[randomizer], gravity)
+            conn.send(pack_frame(OPENED, session.id))
+            self.publish(session, force_board=True)
+            return
+        session = self.sessions.get(id)
+        if session is None:
+            raise ValueError('no session %d' % id)
+        if type == WATCH:
+            session.watchers.add(conn)
+            conn.sessions.add(session)
+            self.publish(session, force_board=True)
+            return
+        # only the owner controls a game
+        if session.owner is not conn:
+            raise ValueError('session %d is not owned by this client' % id)
+        if type == ACTION:
+            self.queue(session, list(payload))
+        elif type == RESET:
+            self.queue(session, [RESET_INPUT])
+        elif type == CLOSE:
+            self.close_session(session)
+        else:
+            raise ValueError('unknown frame type %d' % type)
+
+    async def serve_client(self, reader, writer):
+        conn = Connection(writer)
+        self.connections.add(conn)
+        try:
+            while not conn.closed:
+                type, id, size = HEADER.unpack(await reader.readexactly(HEADER.size))
+                payload = await reader.readexactly(size) if size else b''
+                try:
+                    self.handle(conn, type, id, payload)
+                except (ValueError, AssertionError, struct.error, IndexError) as e:
+                    conn.send(pack_frame(ERROR, id, str(e).encode('utf-8')))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections.discard(conn)
+            for session in list(conn.sessions):
+                if session.owner is conn:
+                    self.close_session(session)
+                else:
+                    session.watchers.discard(conn)
+            conn.closed = True
+            writer.close()
+
+    async def run_ticks(self):
+        loop = asyncio.get_event_loop()
+        interval = 1.0 / self.tick_rate
+        deadline = loop.time()
+        while self.running:
+            start = loop.time()
+            self.tick()
+            now = loop.time()
+            self.tick_time = max(self.tick_time, now - start)
+            deadline += interval
+            if now > deadline:
+                # missed ticks are skipped instead of run in a burst
+                self.overruns += 1
+                deadline = now
+            await asyncio.sleep(deadline - now)
+
+    async def serve(self, host='127.0.0.1', port=7777, path=None):
+        """
+        Serve clients on a localhost TCP port, or on a Unix socket at path,
+        until the task is cancelled.
+        """
+        if path is not None:
+            server = await asyncio.start_unix_server(self.serve_client, path)
+        else:
+            server = await asyncio.start_server(self.serve_client, host, port)
+        self.running = True
+        try:
+            await self.run_ticks()
+        finally:
+            self.running = False
+            server.close()
+            for conn in self.connections:
+                conn.closed = True
+                conn.writer.close()
+            await server.wait_closed()
+
+    def run(self, host='127.0.0.1', port=7777, path=None):
+        """
+        Serve until interrupted.
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.serve(host, port, path))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.close()
+
+
+def connect(address):
+    """
+    Socket connected to address, a (host, port) tuple or a Unix socket path.
+    """
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address)
+        return sock
+    sock = socket.create_connection(address)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class Client(object):
+    """
+    Blocking client of a GameServer, received states are kept as GameState
+    snapshots by a reader thread.
+    Inputs:
+        address:    (host, port) or Unix socket path of the server
+    Important Members:
+        snapshots:  latest GameState of every opened or watched session
+        errors:     messages of ERROR frames
+    """
+    def __init__(self, address):
+        self.sock = connect(address)
+        self.lock = threading.Lock()
+        self.snapshots = {}
+        self.errors = []
+        # (width, height, bytes, column tops) of the last board of sessions
+        self.boards = {}
+        # answers to OPEN frames, session ids and messages of ERROR frames
+        # of session 0, which OPEN frames are sent to
+        self.opened = deque()
+        self.open_errors = deque()
+        self.disconnected = False
+        self.opened_event = threading.Condition()
+        self.reader = threading.Thread(target=self.read_frames)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def send(self, type, session, payload=b''):
+        with self.lock:
+            self.sock.sendall(pack_frame(type, session, payload))
+
+    def open(self, horizon=-1, seed=None, width=10, height=22, hidden_rows=2, randomizer='uniform',
+             gravity=0, timeout=10):
+        """
+        Start a game on the server, see GameServer.open_session.
+        return:
+            session id
+        """
+        payload = OPEN_ARGS.pack(horizon, -1 if seed is None else seed, width, height, hidden_rows,
+                                 RANDOMIZERS.index(randomizer), gravity)
+        with self.opened_event:
+            self.send(OPEN, 0, payload)
+            if not self.opened_event.wait_for(
+                    lambda: self.opened or self.open_errors or self.disconnected, timeout):
+                raise RuntimeError('server did not open a session in %s s' % timeout)
+            if self.open_errors:
+                raise RuntimeError('server refused to open a session: %s' % self.open_errors.popleft())
+            if not self.opened:
+                raise RuntimeError('server closed the connection')
+            return self.opened.popleft()
+
+    def act(self, session, actions):
+        """
+        Queue an action or a sequence of them.
+        """
+        if isinstance(actions, int):
+            actions = [actions]
+        self.send(ACTION, session, bytes(bytearray(actions)))
+
+    def reset(self, session):
+        self.send(RESET, session)
+
+    def watch(self, session):
+        self.send(WATCH, session)
+
+    def close_session(self, session):
+        self.send(CLOSE, session)
+
+    def snapshot(self, session):
+        return self.snapshots.get(session)
+
+    def close(self):
+        # the reader thread holds the socket open until it is shut down
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def read_frames(self):
+        f = self.sock.makefile('rb')
+        try:
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                type, session, size = HEADER.unpack(header)
+                payload = f.read(size)
+                if type == STATE:
+                    self.update(session, payload)
+                elif type == BOARD:
+                    width, height = BOARD_SIZE.unpack_from(payload)
+                    board = payload[BOARD_SIZE.size:]
+                    occupied = np.frombuffer(board, dtype=np.int8).reshape(width, height) > 0
+                    tops = np.where(occupied.any(axis=1), occupied.argmax(axis=1), height)
+                    self.boards[session] = (board, tuple(tops.tolist()))
+                elif type == OPENED:
+                    with self.opened_event:
+                        self.opened.append(session)
+                        self.opened_event.notify_all()
+                elif type == ERROR:
+                    message = payload.decode('utf-8')
+                    self.errors.append(message)
+                    if session == 0:
+                        with self.opened_event:
+                            self.open_errors.append(message)
+                            self.opened_event.notify_all()
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.opened_event:
+                self.disconnected = True
+                self.opened_event.notify_all()
+
+    def update(self, session, payload):
+        t, score, lines, id, index, x, y, held, flags, *queue = STATE_ARGS.unpack(payload)
+        board, tops = self.boards[session]
+        # snapshots are replaced, never changed, like Spectator ones
+        self.snapshots[session] = GameState(
+            board, None, tops,
+            (id, index, x, y) if id >= 0 else None,
+            held if held >= 0 else None,
+            tuple(queue),
+            bool(flags & SWAPPED), score, lines, t, bool(flags & GAME_OVER), None)
+
+
+class RemoteSession(object):
+    """
+    A game on a server seen like a Spectator by GameGUI: snapshot is the
+    latest state and step sends the action without waiting for it.
+    """
+    def __init__(self, client, session):
+        self.client = client
+        self.session = session
+
+    @property
+    def snapshot(self):
+        return self.client.snapshot(self.session)
+
+    def request(self):
+        pass
+
+    def step(self, action):
+        self.client.act(self.session, action)
+
+    def reset(self):
+        self.client.reset(self.session)
+
+
+cmd_parser = argparse.ArgumentParser(description='Host Tetris games for clients of a local socket.')
+cmd_parser.add_argument('--host', default='127.0.0.1',
+                        help='Address to listen on.')
+cmd_parser.add_argument('-p', '--port', default=7777, type=int,
+                        help='TCP port to listen on.')
+cmd_parser.add_argument('-u', '--unix', default=None,
+                        help='Listen on this Unix socket path instead of TCP.')
+cmd_parser.add_argument('-r', '--tick-rate', default=60, type=float,
+                        help='Ticks per second.')
+cmd_parser.add_argument('-m', '--max-actions', default=4, type=int,
+                        help='Max number of inputs of a game applied per tick.')
+cmd_parser.add_argument('-n', '--max-sessions', default=10000, type=int,
+                        help='Max number of games.')
+
+
+if __name__ == '__main__':
+    args = cmd_parser.parse_args()
+    server = GameServer(tick_rate=args.tick_rate, max_actions=args.max_actions,
+                        max_sessions=args.max_sessions)
+    print('serving on %s' % (args.unix or '%s:%d' % (args.host, args.port)))
+    server.run(args.host, args.port, args.unix)
@@ -0,0 +1,137 @@
+import ctypes
+import multiprocessing as mp
+from gym.spaces import Discrete
+import numpy as np
+from .game import Tetris
+
+
+def worker(conn, buffer, shape, dtype, start, count, env_kwargs, seed):
+    """
+    Run count Tetris envs in a worker process, observations are written to
+    rows [start, start+count) of the shared buffer, rewards, dones and
+    action masks if return_info are sent back through conn.
+    """
+    observations = np.frombuffer(buffer, dtype=dtype).reshape((-1,)+shape)[start:start+count]
+    env_kwargs = dict(env_kwargs)
+    return_info = env_kwargs.pop('return_info', False)
+    envs = [Tetris(seed=None if seed is None else seed+start+i, **env_kwargs) for i in range(count)]
+    rewards = np.zeros(count, dtype=np.int64)
+    dones = np.zeros(count, dtype=bool)
+    masks = np.zeros((count, 8), dtype=bool) if return_info else None
+    try:
+        while True:
+            cmd, data = conn.recv()
+            if cmd == 'step':
+                for i, env in enumerate(envs):
+                    state, rewards[i], dones[i] = env.step(data[i])
+                    # auto reset on horizon or game over
+                    if dones[i]:
+                        state = env.reset()
+                    observations[i] = state
+                    if return_info:
+                        masks[i] = env.get_action_mask()
+                conn.send((rewards, dones, masks))
+            elif cmd == 'reset':
+                for i, env in enumerate(envs):
+                    observations[i] = env.reset()
+                    if return_info:
+                        masks[i] = env.get_action_mask()
+                conn.send(masks)
+            elif cmd == 'close':
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+
+
+class SubprocTetris(object):
+    """
+    Tetris envs running in worker processes, each worker steps its share of
+    envs and writes observations into a shared memory buffer, only rewards
+    and dones are sent through pipes. Games are reset as soon as they are over.
+    Inputs:
+        num_envs:       the number of Tetris envs
+        num_workers:    the number of worker processes, default is the number
+                        of cpus
+        seed:           base seed of envs, env k is seeded with seed+k
+        env_kwargs:     arguments passed to every Tetris env, with
+                        return_info step also returns an info dict of
+                        (num_envs, 8) action_mask
+    Important Members:
+        observations:   (num_envs,)+observation shape array backed by shared
+                        memory, it is overwritten by every step/reset
+        action_mask:    (num_envs, 8) valid actions after the last step/reset,
+                        None unless return_info
+    """
+    def __init__(self, num_envs, num_workers=None, seed=None, **env_kwargs):
+        self.num_envs = num_envs
+        self.num_workers = min(num_workers or mp.cpu_count(), num_envs)
+        self.return_info = env_kwargs.pop('return_info', False)
+        env = Tetris(**env_kwargs)
+        self.action_space = Discrete(8)
+        self.observation_space = env.observation_space
+        state = env.reset()
+        shape, dtype = state.shape, state.dtype
+        self.buffer = mp.RawArray(ctypes.c_byte, num_envs*state.nbytes)
+        self.observations = np.frombuffer(self.buffer, dtype=dtype).reshape((num_envs,)+shape)
+        # action masks of the last step or reset, if return_info
+        self.action_mask = None
+        self.conns = []
+        self.processes = []
+        self.closed = False
+        splits = np.array_split(np.arange(num_envs), self.num_workers)
+        self.splits = np.cumsum([0] + [len(envs) for envs in splits])
+        for envs in splits:
+            conn, child_conn = mp.Pipe()
+            p = mp.Process(target=worker,
+                           args=(child_conn, self.buffer, shape, dtype, envs[0], len(envs),
+                                 dict(env_kwargs, return_info=self.return_info), seed))
+            p.daemon = True
+            p.start()
+            child_conn.close()
+            self.conns.append(conn)
+            self.processes.append(p)
+
+    def reset(self):
+        for conn in self.conns:
+            conn.send(('reset', None))
+        masks = [conn.recv() for conn in self.conns]
+        if self.return_info:
+            self.action_mask = np.concatenate(masks)
+        return self.observations
+
+    def step_async(self, actions):
+        actions = np.asarray(actions)
+        for k, conn in enumerate(self.conns):
+            conn.send(('step', actions[self.splits[k]:self.splits[k+1]]))
+
+    def step_wait(self):
+        results = [conn.recv() for conn in self.conns]
+        rewards = np.concatenate([r for r, _, _ in results])
+        dones = np.concatenate([d for _, d, _ in results])
+        if self.return_info:
+            self.action_mask = np.concatenate([m for _, _, m in results])
+            return self.observations, rewards, dones, {'action_mask': self.action_mask}
+        return self.observations, rewards, dones
+
+    def step(self, actions):
+        """
+        Apply one action to every env, see Tetris.step for actions.
+        return:
+            state:      observations, a view of the shared buffer
+            reward:     (num_envs,) score increased by actions
+            done:       (num_envs,) if game over, these envs are reset
+            info:       dict of (num_envs, 8) action_mask, if return_info
+        """
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.closed:
+            return
+        for conn in self.conns:
+            conn.send(('close', None))
+        for p in self.processes:
+            p.join()
+        self.closed = True
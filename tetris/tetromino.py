@@ -139,27 +139,126 @@ Shapes = {
     ])
 }
 
+def build_bottoms(shapes):
+    """
+    Precompute bottom profiles of every orientation of every shape.
+    return:
+        dict of id -> list of tuples of (x offset, y offset of the lowest block)
+        for every occupied column, one tuple per orientation
+    """
+    bottoms = {}
+    for id, orientations in shapes.items():
+        bottoms[id] = []
+        for shape in orientations:
+            profile = []
+            for i, line in enumerate(shape):
+                occupied = [j for j, v in enumerate(line) if v > 0]
+                if len(occupied) > 0:
+                    profile.append((i, max(occupied)))
+            bottoms[id].append(tuple(profile))
+    return bottoms
+
+Bottoms = build_bottoms(Shapes)
+
+def build_blocks(shapes):
+    """
+    Precompute occupied blocks of every orientation of every shape.
+    return:
+        dict of id -> list of tuples of (x offset, y offset, value) for the
+        4 blocks, one tuple per orientation
+    """
+    blocks = {}
+    for id, orientations in shapes.items():
+        blocks[id] = []
+        for shape in orientations:
+            blocks[id].append(tuple((i, j, int(v)) for i, line in enumerate(shape)
+                                                   for j, v in enumerate(line) if v > 0))
+    return blocks
+
+Blocks = build_blocks(Shapes)
+
+def build_bounds(shapes):
+    """
+    Precompute bounding boxes of every orientation of every shape.
+    return:
+        dict of id -> list of (xmin, xmax, ymin, ymax) offsets of the blocks,
+        one tuple per orientation
+    """
+    bounds = {}
+    for id, orientations in shapes.items():
+        bounds[id] = []
+        for shape in orientations:
+            xs, ys = np.nonzero(shape)
+            bounds[id].append((int(xs.min()), int(xs.max()), int(ys.min()), int(ys.max())))
+    return bounds
+
+Bounds = build_bounds(Shapes)
+
+def build_rotations(shapes):
+    """
+    Precompute orientation indices reached by rotations.
+    return:
+        dict of id -> list of (counter clockwise, clockwise) orientation
+        indices, one tuple per orientation
+    """
+    rotations = {}
+    for id, orientations in shapes.items():
+        num = len(orientations)
+        rotations[id] = [((index-1) % num, (index+1) % num) for index in range(num)]
+    return rotations
+
+Rotations = build_rotations(Shapes)
+
+# number of orientations of every shape
+OrientationNum = {id: len(orientations) for id, orientations in Shapes.items()}
+
+def spawn_position(width=10):
+    """
+    Top/left position of spawned pieces, centered on a board of width
+    columns, it is the same for all shapes.
+    """
+    return ((width-4)//2, 0)
+
 class Piece(object):
     """
-    Piece represents a tetromino, it contains all possible shapes of it.
+    Piece represents a tetromino as its shape id, orientation index and
+    position, shapes and the tables above are shared by all pieces.
     id:     which type of shape (0-6)
-    pos:    positiion of this piece top-left block [x, y] (0 <= x <= 5, 0 <= y <= 15)
+    pos:    spawn position of this piece top-left block (x, y), it is moved
+            back there by reset, default=spawn_position() centered on a 10
+            wide board
     """
-    def __init__(self, id, pos=[3, 0]):
-        self.shape = Shapes[id]
+    __slots__ = ('id', 'index', 'x', 'y', 'spawn')
+
+    def __init__(self, id, pos=spawn_position()):
+        self.id = id
         self.index = 0
-        self.pos = pos
-        self.orientation_num = len(self.shape)
+        self.spawn = tuple(pos)
+        self.x, self.y = self.spawn
+
+    @property
+    def shape(self):
+        return Shapes[self.id]
+
+    @property
+    def orientation_num(self):
+        return OrientationNum[self.id]
 
+    @property
+    def pos(self):
+        """
+        (x, y) of current position
+        """
+        return (self.x, self.y)
 
     def get(self):
         """
         Get shape and position from current piece
         return:
             np.array of current shape
-            [x, y] of current position
+            (x, y) of current position
         """
-        return self.shape[self.index], self.pos
+        return Shapes[self.id][self.index], (self.x, self.y)
 
     def commit(self, pos, index):
         """
@@ -168,68 +267,64 @@ class Piece(object):
         pos:    [x, y] of the new position
         index:  orientation index returned by move/rotate calls
         """
-        self.pos = pos
+        self.x, self.y = pos
         self.index = index
 
     def reset(self):
         self.index = 0
-        self.pos = [3, 0]
+        self.x, self.y = self.spawn
 
     def try_move_down(self):
         """
         Try to move piece down one block
         return:
             np.array of next shape if moved down
-            [x, y] next position if moved down
+            (x, y) next position if moved down
             next index if moved down
         """
-        pos = [self.pos[0], self.pos[1]+1]
-        return self.shape[self.index], pos, self.index
+        return Shapes[self.id][self.index], (self.x, self.y+1), self.index
 
     def try_move_left(self):
         """
         Try to move piece left one block
         return:
             np.array of next shape if moved left
-            [x, y] next position if moved left
+            (x, y) next position if moved left
             next index if moved left
         """
-        pos = [self.pos[0]-1, self.pos[1]]
-        return self.shape[self.index], pos, self.index
+        return Shapes[self.id][self.index], (self.x-1, self.y), self.index
 
     def try_move_right(self):
         """
         Try to move piece right one block
         return:
             np.array of next shape if moved right
-            [x, y] next position if moved right
+            (x, y) next position if moved right
             next index if moved right
         """
-        pos = [self.pos[0]+1, self.pos[1]]
-
-        return self.shape[self.index], pos, self.index
+        return Shapes[self.id][self.index], (self.x+1, self.y), self.index
 
     def try_rotate_clockwise(self):
         """
         Try to rotate clockwise
         return:
             np.array of next shape if rotated
-            [x, y] next position if rotated
+            (x, y) next position if rotated
             next index if rotated
         """
-        index = (self.index+1) % self.orientation_num
-        return self.shape[index], self.pos, index
+        index = Rotations[self.id][self.index][1]
+        return Shapes[self.id][index], (self.x, self.y), index
 
     def try_rotate_counter_clockwise(self):
         """
         Try to rotate counter clockwise
         return:
             np.array of next shape if rotated
-            [x, y] next position if rotated
+            (x, y) next position if rotated
             next index if rotated
         """
-        index = (self.index-1) % self.orientation_num
-        return self.shape[index], self.pos, index
+        index = Rotations[self.id][self.index][0]
+        return Shapes[self.id][index], (self.x, self.y), index
 
 
 # tests
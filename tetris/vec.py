@@ -0,0 +1,417 @@
+from gym.spaces import Discrete
+import numpy as np
+from .tetromino import Shapes, spawn_position
+from .observation import FORMATS, observation_space, observation_shape, queue_tiles, encode
+from .randomizer import Randomizer
+from .features import board_features
+
+
+def build_tables(shapes):
+    """
+    Precompute lookup tables of all shapes for vectorized operations.
+    return:
+        cells:              (7, 4, 4, 2) [x, y] offsets of the 4 blocks of
+                            every orientation, shapes that have less than 4
+                            orientations are repeated
+        orientation_num:    (7,) number of orientations of every shape
+        tiles:              (7, 4, 4) spawn shape shown in next queue
+    """
+    cells = np.zeros((7, 4, 4, 2), dtype=int)
+    orientation_num = np.zeros(7, dtype=int)
+    tiles = np.zeros((7, 4, 4), dtype=np.int8)
+    for id, orientations in shapes.items():
+        orientation_num[id] = len(orientations)
+        tiles[id] = orientations[0]
+        for index in range(4):
+            cells[id, index] = np.argwhere(orientations[index % len(orientations)] > 0)
+    return cells, orientation_num, tiles
+
+
+Cells, OrientationNum, Tiles = build_tables(Shapes)
+
+# position and orientation changes of actions, indexed by action
+MOVE_X = np.array([0, -1, 1, 0, 0, 0, 0, 0])
+MOVE_Y = np.array([0, 0, 0, 1, 0, 0, 0, 0])
+ROTATE = np.array([0, 0, 0, 0, 0, -1, 1, 0])
+# score bonus indexed by the number of cleared lines
+LINE_BONUS = np.array([0, 40, 100, 300, 1200])
+
+
+class VecTetris(object):
+    """
+    A batch of tetris games that are stepped together with vectorized NumPy
+    operations, every game follows the same rules as Tetris.
+    Inputs:
+        num_envs:               the number of games in the batch
+        horizon:                the max number of steps for an episode,
+                                default = 5000, -1 means infinity
+        flattened_observation:  if provide flattened observation as 1D array
+                                rather than board and next queue, default=False
+        observation_format:     'int8', 'packed' or 'onehot', see Tetris
+        seed:                   seed of the piece sequences, game k is seeded
+                                with seed+k and draws the same pieces as
+                                Tetris(seed=seed+k)
+        randomizer:             'uniform' or 'bag', see Tetris
+        auto_reset:             reset games as soon as they are over, the
+                                observation returned for them is the first one
+                                of the new episode, default=True
+        return_info:            if step and step_many also return an info
+                                dict with (N, 8) action_mask, see
+                                Tetris.get_action_mask, default=False
+        width, height, hidden_rows: size of main boards, see Tetris
+    Important Members:
+        boards:         (N, width, height) tetris game boards, hidden_rows
+                        rows are invisible
+        piece_id:       (N,) shape id of current pieces
+        piece_index:    (N,) orientation index of current pieces
+        piece_pos:      (N, 2) top/left [x, y] position of current pieces
+        held_id:        (N,) shape id of held pieces, -1 if hold queue is empty
+        next_queue:     (N, 5) shape ids that will be spawned, last one first
+        score:          (N,) score of current games
+    """
+    def __init__(self, num_envs, horizon=5000, flattened_observation=False, seed=None, auto_reset=True,
+                 observation_format='int8', randomizer='uniform', return_info=False,
+                 width=10, height=22, hidden_rows=2):
+        assert observation_format in FORMATS, 'unknown observation format: %s' % observation_format
+        assert width >= 4 and height >= 4, 'main board must be at least 4x4'
+        assert 0 <= hidden_rows < height, 'hidden rows must leave visible rows'
+        self.width = width
+        self.height = height
+        self.hidden_rows = hidden_rows
+        self.spawn = spawn_position(width)
+        self.num_envs = num_envs
+        self.horizon = horizon
+        self.next_queue_size = 5
+        self.flattened_observation = flattened_observation
+        self.auto_reset = auto_reset
+        self.return_info = return_info
+        self.observation_format = observation_format
+        self.action_space = Discrete(8)
+        self.observation_space = observation_space(observation_format, flattened_observation,
+                                                    self.next_queue_size, width, height-hidden_rows)
+        self.down_step_score = 1
+        self.randomizer_mode = randomizer
+        self.seed(seed)
+        self.all_envs = np.arange(num_envs)
+        self.boards = np.zeros((num_envs, width, height), dtype=np.int8)
+        self.piece_id = np.zeros(num_envs, dtype=int)
+        self.piece_index = np.zeros(num_envs, dtype=int)
+        self.piece_pos = np.zeros((num_envs, 2), dtype=int)
+        self.held_id = np.full(num_envs, -1, dtype=int)
+        self.next_queue = np.zeros((num_envs, self.next_queue_size), dtype=int)
+        self.swapped = np.zeros(num_envs, dtype=bool)
+        self.game_over = np.ones(num_envs, dtype=bool)
+        self.score = np.zeros(num_envs, dtype=int)
+        self.t = np.zeros(num_envs, dtype=int)
+
+    def seed(self, seed=None):
+        if seed is None:
+            self.randomizers = [Randomizer(None, self.randomizer_mode) for _ in range(self.num_envs)]
+        else:
+            self.randomizers = [Randomizer(seed+k, self.randomizer_mode) for k in range(self.num_envs)]
+        return [r.seed for r in self.randomizers]
+
+    def draw(self, envs, num=1):
+        """
+        Draw num shape ids from the sequence of every env in envs.
+        return:
+            (len(envs), num) shape ids in drawing order
+        """
+        return np.array([[self.randomizers[e].next() for _ in range(num)] for e in envs],
+                        dtype=int).reshape(len(envs), num)
+
+    def reset(self):
+        self.reset_envs(self.all_envs)
+        return self.get_observation()
+
+    def reset_envs(self, envs):
+        """
+        Start new games for envs, an array of env indexes.
+        """
+        self.boards[envs] = 0
+        self.held_id[envs] = -1
+        self.swapped[envs] = False
+        self.game_over[envs] = False
+        self.score[envs] = 0
+        self.t[envs] = 0
+        # the last one of next queue is spawned first
+        self.next_queue[envs] = self.draw(envs, self.next_queue_size)[:, ::-1]
+        self.spawn_piece(envs)
+
+    def step(self, actions):
+        """
+        Apply one action to every game, see Tetris.step for actions.
+        input:
+            actions:    (N,) actions of every game
+        return:
+            state:      stacked observations
+            reward:     (N,) score increased by actions
+            done:       (N,) if game over
+            info:       dict of (N, 8) action_mask, if return_info
+        """
+        reward = self.play_actions(np.asarray(actions))
+        done = self.game_over.copy()
+        if self.auto_reset and done.any():
+            self.reset_envs(np.nonzero(done)[0])
+        if self.return_info:
+            return self.get_observation(), reward, done, {'action_mask': self.get_action_mask()}
+        return self.get_observation(), reward, done
+
+    def step_many(self, actions, return_rewards=False):
+        """
+        Apply a sequence of actions to every game like calling step for
+        each of them, but only observations after the last ones are built.
+        Games that are over ignore the rest of their actions, they are
+        reset after all actions are applied.
+        input:
+            actions:        (N, k) k actions of every game
+            return_rewards: if also return the reward of every action
+        return:
+            state:      stacked observations
+            reward:     (N,) score increased by actions
+            done:       (N,) if game over
+            rewards:    (N, k) reward of every action, if return_rewards
+            info:       dict of (N, 8) action_mask, if return_info
+        """
+        actions = np.asarray(actions)
+        rewards = np.zeros(actions.shape, dtype=int)
+        for k in range(actions.shape[1]):
+            rewards[:, k] = self.play_actions(actions[:, k])
+        done = self.game_over.copy()
+        if self.auto_reset and done.any():
+            self.reset_envs(np.nonzero(done)[0])
+        result = (self.get_observation(), rewards.sum(axis=1), done)
+        if return_rewards:
+            result += (rewards,)
+        if self.return_info:
+            result += ({'action_mask': self.get_action_mask()},)
+        return result
+
+    def get_action_mask(self):
+        """
+        Valid actions of every game, see Tetris.get_action_mask.
+        return:
+            (N, 8) bool array
+        """
+        mask = np.zeros((self.num_envs, 8), dtype=bool)
+        mask[:, 0] = True
+        envs = np.nonzero(~self.game_over)[0]
+        if len(envs) == 0:
+            return mask
+        ids = self.piece_id[envs]
+        index = self.piece_index[envs]
+        pos = self.piece_pos[envs]
+        for action, dx in ((1, -1), (2, 1)):
+            moved = pos.copy()
+            moved[:, 0] += dx
+            mask[envs, action] = self.check_piece(envs, ids, index, moved)
+        mask[envs, 3] = True
+        mask[envs, 4] = True
+        num = OrientationNum[ids]
+        for action, turn in ((5, -1), (6, 1)):
+            rotated = (index + turn) % num
+            ok = np.zeros(len(envs), dtype=bool)
+            for dx in (0, 1, -1):
+                kick = pos.copy()
+                kick[:, 0] += dx
+                ok |= self.check_piece(envs, ids, rotated, kick)
+            mask[envs, action] = ok & (num > 1)
+        mask[envs, 7] = ~self.swapped[envs]
+        return mask
+
+    def play_actions(self, actions):
+        """
+        Apply one action to every game without building observations.
+        return:
+            reward:     (N,) score increased by actions
+        """
+        reward = np.zeros(self.num_envs, dtype=int)
+        live = ~self.game_over
+        envs = np.nonzero(live & (actions >= 1) & (actions <= 6) & (actions != 4))[0]
+        if len(envs) > 0:
+            self.move_piece(envs, actions[envs], reward)
+        envs = np.nonzero(live & (actions == 4))[0]
+        if len(envs) > 0:
+            self.hard_drop(envs, reward)
+        envs = np.nonzero(live & (actions == 7))[0]
+        if len(envs) > 0:
+            self.hold_piece(envs)
+        # noop and other actions don't count as a step
+        stepped = live & (actions >= 1) & (actions <= 7)
+        self.t[stepped] += 1
+        if self.horizon >= 0:
+            self.game_over[stepped & (self.t >= self.horizon)] = True
+        return reward
+
+    def move_piece(self, envs, actions, reward):
+        """
+        Move or rotate pieces, pieces that can't move down are landed.
+        """
+        ids = self.piece_id[envs]
+        index = (self.piece_index[envs] + ROTATE[actions]) % OrientationNum[ids]
+        pos = self.piece_pos[envs].copy()
+        pos[:, 0] += MOVE_X[actions]
+        pos[:, 1] += MOVE_Y[actions]
+        ok = self.check_piece(envs, ids, index, pos)
+        self.piece_index[envs[ok]] = index[ok]
+        self.piece_pos[envs[ok]] = pos[ok]
+        failed = ~ok
+        # move down failed, piece landed
+        landed = failed & (actions == 3)
+        if landed.any():
+            reward[envs[landed]] += self.land_piece(envs[landed])
+        # rotate failed, check spins on the right then on the left
+        rotated = failed & (actions >= 5)
+        for dx in (1, -1):
+            if not rotated.any():
+                break
+            kick = pos[rotated]
+            kick[:, 0] += dx
+            ok = self.check_piece(envs[rotated], ids[rotated], index[rotated], kick)
+            kicked = envs[rotated][ok]
+            self.piece_index[kicked] = index[rotated][ok]
+            self.piece_pos[kicked] = kick[ok]
+            rotated[np.nonzero(rotated)[0][ok]] = False
+
+    def hard_drop(self, envs, reward):
+        """
+        Drop pieces straight down and land them.
+        """
+        cells = Cells[self.piece_id[envs], self.piece_index[envs]]
+        x = self.piece_pos[envs, 0, None] + cells[:, :, 0]
+        y = self.piece_pos[envs, 1, None] + cells[:, :, 1]
+        # first occupied row below every block of the pieces
+        below = (self.boards[envs[:, None], x] > 0) & (np.arange(self.height) > y[:, :, None])
+        floor = np.where(below.any(axis=2), below.argmax(axis=2), self.height)
+        dist = (floor - y - 1).min(axis=1)
+        self.piece_pos[envs, 1] += dist
+        self.score[envs] += dist * self.down_step_score
+        reward[envs] += dist * self.down_step_score
+        reward[envs] += self.land_piece(envs)
+
+    def hold_piece(self, envs):
+        """
+        Swap pieces with hold queue, games that failed to swap are over.
+        """
+        swap = envs[~self.swapped[envs]]
+        self.swapped[envs] = True
+        if len(swap) == 0:
+            return
+        empty = swap[self.held_id[swap] < 0]
+        full = swap[self.held_id[swap] >= 0]
+        held = self.held_id[full]
+        self.held_id[swap] = self.piece_id[swap]
+        self.spawn_piece(empty)
+        self.piece_id[full] = held
+        self.piece_index[full] = 0
+        self.piece_pos[full] = self.spawn
+        ok = self.check_piece(swap, self.piece_id[swap], self.piece_index[swap], self.piece_pos[swap])
+        self.game_over[swap[~ok]] = True
+
+    def spawn_piece(self, envs):
+        """
+        Take next pieces from next queue, games that can't spawn are over.
+        """
+        if len(envs) == 0:
+            return
+        self.piece_id[envs] = self.next_queue[envs, -1]
+        self.next_queue[envs, 1:] = self.next_queue[envs, :-1]
+        self.next_queue[envs, 0] = self.draw(envs)[:, 0]
+        self.piece_index[envs] = 0
+        self.piece_pos[envs] = self.spawn
+        ok = self.check_piece(envs, self.piece_id[envs], self.piece_index[envs], self.piece_pos[envs])
+        self.game_over[envs[~ok]] = True
+
+    def land_piece(self, envs):
+        """
+        Save pieces to boards, clear lines and spawn next pieces.
+        return:
+            bonus:  (len(envs),) score increased by cleared lines
+        """
+        ids = self.piece_id[envs]
+        cells = Cells[ids, self.piece_index[envs]]
+        x = self.piece_pos[envs, 0, None] + cells[:, :, 0]
+        y = self.piece_pos[envs, 1, None] + cells[:, :, 1]
+        self.boards[envs[:, None], x, y] = ids[:, None] + 1
+        bonus = self.clear_lines(envs)
+        # reset hold queue flag
+        self.swapped[envs] = False
+        self.spawn_piece(envs)
+        return bonus
+
+    def clear_lines(self, envs):
+        """
+        Remove full lines of boards and shift the rows above down.
+        return:
+            bonus:  (len(envs),) score increased by cleared lines
+        """
+        full = (self.boards[envs] > 0).all(axis=1)
+        num = full.sum(axis=1)
+        bonus = LINE_BONUS[num]
+        cleared = num > 0
+        if cleared.any():
+            e = envs[cleared]
+            # stable sort moves full rows on top and keeps the order of others
+            order = np.argsort(~full[cleared], axis=1, kind='stable')
+            boards = np.take_along_axis(self.boards[e], order[:, None, :], axis=2)
+            boards *= np.arange(self.height) >= num[cleared, None, None]
+            self.boards[e] = boards
+            self.score[envs] += bonus
+        return bonus
+
+    def check_piece(self, envs, ids, index, pos):
+        """
+        Check if pieces are valid on boards.
+        input:
+            envs:   (M,) env indexes
+            ids:    (M,) shape ids
+            index:  (M,) orientation indexes
+            pos:    (M, 2) [x, y] of the top-left block locations
+        return:
+            (M,) True if valid False otherwise
+        """
+        cells = Cells[ids, index]
+        x = pos[:, 0, None] + cells[:, :, 0]
+        y = pos[:, 1, None] + cells[:, :, 1]
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        blocked = self.boards[envs[:, None], np.clip(x, 0, self.width-1), np.clip(y, 0, self.height-1)] > 0
+        return (inside & ~blocked).all(axis=1)
+
+    def get_features(self):
+        """
+        Features of main boards without current pieces, see features.py.
+        return:
+            (N,) array of features_dtype(width) records
+        """
+        return board_features(self.boards)
+
+    def look_board(self):
+        """
+        look at main boards with current moving pieces.
+        only returns boards that visible to player (N, width, visible rows)
+        """
+        boards = self.boards.copy()
+        envs = np.nonzero(~self.game_over)[0]
+        ids = self.piece_id[envs]
+        cells = Cells[ids, self.piece_index[envs]]
+        x = self.piece_pos[envs, 0, None] + cells[:, :, 0]
+        y = self.piece_pos[envs, 1, None] + cells[:, :, 1]
+        boards[envs[:, None], x, y] = ids[:, None] + 1
+        return boards[:, :, self.hidden_rows:]
+
+    def get_observation(self):
+        """
+        Stacked observations of all games, same layout as Tetris.
+        """
+        board = self.look_board()
+        nq = Tiles[self.next_queue]
+        if self.flattened_observation:
+            out = np.concatenate((board.reshape(self.num_envs, -1), nq.reshape(self.num_envs, -1)), axis=1)
+            return encode(out, self.observation_format, True)
+        visible = self.height - self.hidden_rows
+        shape = observation_shape(self.width, visible, self.next_queue_size)
+        out = np.zeros((self.num_envs, 1)+shape, dtype=board.dtype)
+        out[:, 0, :, :visible] = board
+        for k, (x, y) in enumerate(queue_tiles(self.width, visible, self.next_queue_size)):
+            out[:, 0, x:x+4, y:y+4] = nq[:, k]
+        return encode(out, self.observation_format)
@@ -0,0 +1,120 @@
+from collections import OrderedDict, namedtuple
+import numpy as np
+
+
+# A set of random 64 bit keys of every block value of every cell of main
+# board, and of every shape, orientation and position of pieces, a state hash
+# is the xor of the keys of its parts
+Keys = namedtuple('Keys', ['cells', 'pieces', 'held', 'swapped'])
+
+# positions of pieces are offset by PIECE_OFFSET, their top/left corner can
+# be outside of main board
+PIECE_OFFSET = 4
+# keys of the board sizes used last, by (width, height), the least recently
+# used ones are dropped beyond MAX_KEY_SETS, envs keep the keys they use
+key_sets = OrderedDict()
+MAX_KEY_SETS = 8
+
+
+def zobrist_keys(width=10, height=22):
+    """
+    Keys of boards of width x height blocks, they are drawn from the same
+    seed whenever a board size is used, so they are always the same.
+    return:
+        Keys:
+            cells:      (width, height, 8) uint64 keys of block values of
+                        cells, empty cells are 0 so they don't change the hash
+            pieces:     (7, 4, width+2*PIECE_OFFSET, height+2*PIECE_OFFSET)
+                        uint64 keys of shape id, orientation index and
+                        position offset by PIECE_OFFSET
+            held:       keys of held piece by shape id, the last one is 0 for
+                        no held piece
+            swapped:    key of swapped flag
+    """
+    size = (width, height)
+    if size in key_sets:
+        key_sets.move_to_end(size)
+        return key_sets[size]
+    rng = np.random.RandomState(0x7e7515)
+    cells = rng.randint(0, 2**64, size=(width, height, 8), dtype=np.uint64)
+    cells[:, :, 0] = 0
+    pieces = rng.randint(0, 2**64, size=(7, 4, width+2*PIECE_OFFSET, height+2*PIECE_OFFSET),
+                         dtype=np.uint64)
+    held = rng.randint(0, 2**64, size=8, dtype=np.uint64).tolist()
+    held[7] = 0
+    swapped = int(rng.randint(0, 2**64, dtype=np.uint64))
+    key_sets[size] = Keys(cells, pieces, held, swapped)
+    if len(key_sets) > MAX_KEY_SETS:
+        key_sets.popitem(last=False)
+    return key_sets[size]
+
+
+def board_hash(boards):
+    """
+    Zobrist hash of the cells of one (width, height) board or of a stack of
+    boards.
+    return:
+        int hash of the board, uint64 array of hashes for a stack of boards
+    """
+    boards = np.asarray(boards)
+    width, height = boards.shape[-2:]
+    cells = zobrist_keys(width, height).cells
+    keys = cells[np.arange(width)[:, None], np.arange(height), boards.astype(np.intp)]
+    hashes = np.bitwise_xor.reduce(keys.reshape(boards.shape[:-2]+(-1,)), axis=-1)
+    if boards.ndim == 2:
+        return int(hashes)
+    return hashes
+
+
+def piece_key(id, index, pos, keys=None):
+    """
+    Key of a piece at pos, keys default to the ones of the default board.
+    """
+    if keys is None:
+        keys = zobrist_keys()
+    return int(keys.pieces[id, index, pos[0]+PIECE_OFFSET, pos[1]+PIECE_OFFSET])
+
+
+class TranspositionTable(object):
+    """
+    Cache of values keyed by state hashes, the least recently used entry is
+    dropped when it is full.
+    Inputs:
+        maxsize:    max number of entries, default=65536
+    Important Members:
+        hits, misses:   counts of get calls that found a value or not
+    """
+    def __init__(self, maxsize=2**16):
+        assert maxsize > 0, 'maxsize must be positive'
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        entries = self.entries
+        if key in entries:
+            entries.move_to_end(key)
+            self.hits += 1
+            return entries[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        entries = self.entries
+        if key in entries:
+            entries.move_to_end(key)
+        elif len(entries) >= self.maxsize:
+            entries.popitem(last=False)
+        entries[key] = value
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0